@@ -4,17 +4,30 @@
 #=============================== __ July 2020 __ ==============================
 #==============================================================================
 
-from sys import argv
+from sys import argv, stdout
 from lark import Lark, Transformer, v_args
-from itertools import chain
+from itertools import chain, product
+from collections import deque
+from bisect import bisect_left, bisect_right
 from time import time
 
 ## Representation imports:
 from enum import Enum
 from time import time
 from sys import exit 
-from os import system, remove
-from os.path import exists
+from os import remove, path
+from json import loads, load, dump
+from array import array
+from ast import literal_eval
+import ast
+import re
+import csv
+import builtins
+
+## Profiling imports:
+from time import perf_counter, process_time
+from contextlib import contextmanager, nullcontext
+import tracemalloc
 
 try:
     input = raw_input   # for Python2 compatibility
@@ -30,6 +43,7 @@ grammar = '''
                 start: value* formula_family? -> return_formula
 
                 value : "value:" NAME "=" expression ";" -> handle_value
+                      | "value:" NAME "from" DATA_FILE ("as" DATA_FORMAT)? ";" -> handle_data
 
                 formula_family : name format parameters? variables blocks output_block
 
@@ -77,9 +91,11 @@ grammar = '''
                                         | "all blocks in" BLOCK_NAME "quantified with" QUANTIFIER ";" -> add_attribute_to_grouping
 
 
-                operator_declaration:   "block" BLOCK_NAME ("(" indices ")")? "operated with" OPERATOR ";" -> add_attributes
-                                      | "blocks" BLOCK_NAME ("(" indices ")")? ("," BLOCK_NAME ("(" indices ")")?)+ "operated with" OPERATOR ";" -> add_attributes
-                                      | "all blocks in" BLOCK_NAME "operated with" OPERATOR ";" -> add_attribute_to_grouping
+                operator_declaration:   "block" BLOCK_NAME ("(" indices ")")? "operated with" (OPERATOR | cardinality) ";" -> add_attributes
+                                      | "blocks" BLOCK_NAME ("(" indices ")")? ("," BLOCK_NAME ("(" indices ")")?)+ "operated with" (OPERATOR | cardinality) ";" -> add_attributes
+                                      | "all blocks in" BLOCK_NAME "operated with" (OPERATOR | cardinality) ";" -> add_attribute_to_grouping
+
+                cardinality: CARDINALITY expression
 
                 output_block: "output block:" BLOCK_NAME ("(" indices ")")? ";" -> add_final_block
 
@@ -94,7 +110,10 @@ grammar = '''
                 //BLOCK_NAME : /[A-Z]([_?a-zA-Z0-9])*/ old block_name regex
                 NEGATION : "-" | "¬"
                 QUANTIFIER : "E" | "A" | "∃" | "∀"
-                OPERATOR: "AND" | "OR" | "XOR" | "=>" | "<=>" | "⊕" | "∨" | "∧" | "→" | "↔" | "⇔" | "⇒" | "ITE" | "if-then-else" | "⤙"
+                OPERATOR: "AND" | "OR" | "XOR" | "=>" | "<=>" | "⊕" | "∨" | "∧" | "→" | "↔" | "⇔" | "⇒" | "ITE" | "if-then-else" | "⤙" | "AMO" | "EXO"
+                CARDINALITY: "AtMost" | "AtLeast" | "Exactly"
+                DATA_FILE : /"[^"]*"/
+                DATA_FORMAT : "npy" | "csv" | "json" | "edges" | "undirected-edges"
                 COMMENT: /\/\*((\*[^\/])|[^*])*\*\//
                 RESERVED: "define" | "block" | "blocks" | "grouped" | "in" | "quantified" | "operated" | "with" | "output" | "all" | "where" | "name" | "format" | "parameters" | "variables"
 
@@ -129,6 +148,41 @@ class Operator(Enum):
     IMP = 'imp'
     DIMP = 'dimp'
     ITE  = 'ite'
+
+"""
+    A cardinality constraint on the bricks of a block: at most, at least or
+    exactly k of them are true. Blocks with a cardinality constraint are not
+    gates, they are expanded into AND and OR gates before the output, with
+    one of the CARDINALITY_ENCODINGS.
+"""
+class Cardinality:
+
+    __slots__ = ("kind", "k")
+
+    def __init__(self, kind, k):
+        self.kind = kind
+        self.k = k
+
+    @property
+    def value(self):
+        return "{} {}".format(self.kind, self.k)
+
+    def __eq__(self, other):
+        return isinstance(other, Cardinality) and self.kind == other.kind and self.k == other.k
+
+    def __hash__(self):
+        return hash((self.kind, self.k))
+
+CARDINALITY_KINDS = {"AtMost": "atmost", "AtLeast": "atleast", "Exactly": "exactly"}
+CARDINALITY_ENCODINGS = ["sequential", "commander", "ladder", "totalizer"]
+
+# operators whose result does not depend on the order of the operands
+COMMUTATIVE_OPERATORS = ["or", "and", "xor", "dimp"]
+
+# polarities in which a gate is used, as bits
+POSITIVE = 1
+NEGATIVE = 2
+BOTH_POLARITIES = POSITIVE | NEGATIVE
     
 class Format(Enum):
     circuit_PRENEX = 'circuit-prenex'
@@ -151,11 +205,198 @@ class Parameter:
     def get_name(self):
         return self.paramName
     
+#==============================================================================
+#=========================== Variable representation ==========================
+#==============================================================================
+
+# Declarations of at least this many variables are kept as a VariableArray.
+# Computing the id of a variable of an array is slower than looking it up
+# in a dictionary, so smaller declarations are still stored one by one.
+DENSE_VARIABLES_MIN = 1 << 16
+
+"""
+    A box of variables declared at once, like x(i, j) where i in 1..n, j in
+    1..k. Their ids are consecutive, in the order in which the declaration
+    enumerates them, so the id of a variable is computed from its indices
+    as base + sum of stride * (index - low) instead of being stored.
+"""
+class VariableArray:
+
+    __slots__ = ("name", "length", "literals", "dims", "base", "offset", "size")
+
+    """
+        Creates the array of the variables named name whose keys have the
+        given length. Literals are the (position, value) pairs of the fixed
+        indices of the keys, and ranges the (position, low, high) triples
+        of the ranged ones, from the slowest to the fastest varying.
+    """
+    def __init__(self, name, length, literals, ranges, base):
+        self.name = name
+        self.length = length
+        self.literals = literals
+        self.base = base
+        self.dims = []
+        stride = 1
+        for pos, lo, hi in reversed(ranges):
+            self.dims.insert(0, (pos, lo, hi, stride))
+            stride = stride * max(hi - lo + 1, 0)
+        self.size = stride
+        # id of the variable with all indices equal to 0, possibly outside
+        self.offset = base - sum([lo * stride for pos, lo, hi, stride in self.dims])
+
+    def lookup(self, key):
+        if len(key) != self.length:
+            return None
+        varId = self.offset
+        for pos, lo, hi, stride in self.dims:
+            ix = key[pos]
+            if type(ix) is not int or not lo <= ix <= hi:
+                return None
+            varId += ix * stride
+        for pos, value in self.literals:
+            if key[pos] != value:
+                return None
+        return varId
+
+    def keys(self):
+        key = [self.name] + [None] * (self.length - 1)
+        for pos, value in self.literals:
+            key[pos] = value
+        ranges = [range(lo, hi + 1) for pos, lo, hi, stride in self.dims]
+        for values in product(*ranges):
+            for i in range(len(values)):
+                key[self.dims[i][0]] = values[i]
+            yield tuple(key)
+
+    """
+        Returns the key of a variable in both arrays, or None if they are
+        disjoint. If they intersect, the key made of their fixed indices and
+        of the greatest lower bound of every other index is in both.
+    """
+    def intersection(self, other):
+        if self.length != other.length:
+            return None
+        fixed = dict(self.literals + other.literals)
+        key = [self.name]
+        for pos in range(1, self.length):
+            if pos in fixed:
+                key.append(fixed[pos])
+            else:
+                key.append(max([lo for p, lo, hi, stride in self.dims + other.dims if p == pos]))
+        key = tuple(key)
+        if self.lookup(key) is not None and other.lookup(key) is not None:
+            return key
+        return None
+
+"""
+    The table of the variables of a QBF, mapping their keys to their ids
+    like a dictionary. Variables declared one by one are kept in a
+    dictionary, and boxes of variables in VariableArray objects, without
+    any per-variable storage. Variables are listed in declaration order,
+    which is also the order of their ids.
+"""
+class VariableTable:
+
+    def __init__(self):
+        self.explicit = {}
+        self.arrays = {}
+        self.segments = []
+        self.count = 0
+
+    def get(self, key, default=None):
+        varId = self.explicit.get(key)
+        if varId is None and self.arrays:
+            varId = self.array_lookup(key)
+        return default if varId is None else varId
+
+    def array_lookup(self, key):
+        for array in self.arrays.get(key[0], ()):
+            varId = array.lookup(key)
+            if varId is not None:
+                return varId
+        return None
+
+    def __getitem__(self, key):
+        varId = self.get(key)
+        if varId is None:
+            raise KeyError(key)
+        return varId
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __setitem__(self, key, varId):
+        self.explicit[key] = varId
+        self.count += 1
+        if not self.segments or isinstance(self.segments[-1], VariableArray):
+            self.segments.append([])
+        self.segments[-1].append(key)
+
+    def add_array(self, array):
+        self.arrays.setdefault(array.name, []).append(array)
+        self.count += array.size
+        self.segments.append(array)
+
+    """
+        Returns the key of a variable that is both in the array and in the
+        table, or None if there is none.
+    """
+    def overlap(self, array):
+        for other in self.arrays.get(array.name, []):
+            key = array.intersection(other)
+            if key is not None:
+                return key
+        for key in self.explicit:
+            if key[0] == array.name and array.lookup(key) is not None:
+                return key
+        return None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for segment in self.segments:
+            if isinstance(segment, VariableArray):
+                yield from segment.keys()
+            else:
+                yield from segment
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for key in self:
+            yield key, self[key]
+
 #==============================================================================
 #============================= Block representation ===========================
 #==============================================================================
 
+"""
+    Variables and blocks are identified by (name, index values...) tuples,
+    see QBF.normalize_name. This gives back the readable form of such a key,
+    e.g. 'x( 3 7 )', used in messages and in the internal representation.
+"""
+def readable_name(key):
+    return key[0] + "(" + "".join([" " + str(ix) for ix in key[1:]]) + " )"
+
+"""
+    Returns the form of an index value in a key: an int if its text is the
+    usual text of an int, like 7 or '7', and its text otherwise, like '07',
+    '1.0' or 'True'. Two index values are then the same in a key exactly
+    when their texts are the same, as when keys were strings.
+"""
+def canonical_index(value):
+    text = value if type(value) is str else str(value)
+    try:
+        number = int(text)
+    except ValueError:
+        return text
+    return number if str(number) == text else text
+
 class Block:
+
+    __slots__ = ("blockName", "blockId", "blockBody", "blockGroup", "blockAtt")
     
     def __init__(self, bName = "", bId = "", bBody = [], bGroup = None, bAtt = None):
         self.blockName = bName
@@ -166,7 +407,7 @@ class Block:
         
     def add_attribute(self, bAtt):
         if self.blockAtt:
-            print("ATTRIBUTE ERROR: block {} already has an attribute ({}) and thus it cannot be assigned another one ({}).".format(self.blockName, self.blockAtt.value, bAtt))
+            print("ATTRIBUTE ERROR: block {} already has an attribute ({}) and thus it cannot be assigned another one ({}).".format(readable_name(self.blockName), self.blockAtt.value, bAtt))
             exit()
 
         if bAtt == "E" or bAtt == "∃":
@@ -185,6 +426,12 @@ class Block:
             self.blockAtt = Operator.DIMP
         elif bAtt == "ITE" or bAtt == "if-then-else" or bAtt == "⤙":
             self.blockAtt = Operator.ITE
+        elif bAtt == "AMO":
+            self.blockAtt = Cardinality("atmost", 1)
+        elif bAtt == "EXO":
+            self.blockAtt = Cardinality("exactly", 1)
+        elif isinstance(bAtt, Cardinality):
+            self.blockAtt = bAtt
         else:
             print("ATTRIBUTE ERROR: attribute {} is not a valid input.".format(bAtt))
             exit()
@@ -197,6 +444,9 @@ class Block:
 
     def get_id(self):
         return self.blockId
+
+    def get_group(self):
+        return self.blockGroup
     
     def get_attribute_str(self):
         if not self.blockAtt:
@@ -212,15 +462,755 @@ class Block:
         else:
             return False
 
+#==============================================================================
+#=========================== Compact block storage ============================
+#==============================================================================
+
+# Code of the ids that are not blocks in the attribute bytes of a compact
+# store, and in its attribute array once it needs more codes than a byte
+ABSENT = 255
+ABSENT_WIDE = 65535
+
+"""
+    A replacement for the blocks dictionary of a QBF object, mapping the
+    keys of the blocks to their ids, used along with a CompactBlockStore.
+    Blocks declared one after the other whose keys only differ in their
+    last index, which grows by one along with the id, as those of a block
+    definition over ranges, make up a run stored as its first key and id
+    and its length, instead of one entry per block. The runs of a prefix
+    (a key without its last index) are kept sorted by their first index,
+    and found by bisection. Blocks that are not part of any run, as those
+    of filtered or transposed indices, are kept in a plain dictionary. The
+    key of a block is given back from its id by key_of, so the store does
+    not keep them. Keys are added in increasing order of their ids, and
+    only once.
+"""
+class BlockTable:
+
+    def __init__(self):
+        # prefix -> run, or [first last indices, runs] sorted by the former
+        self.prefixes = {}
+        # prefix, first last index, first id and length of every run, in
+        # increasing order of their ids; runs have two blocks at least
+        self.run_prefixes = []
+        self.run_starts = array('q')
+        self.run_ids = array('q')
+        self.run_lengths = array('q')
+        # blocks not in a run: key -> id, and their ids and keys in order
+        self.singles = {}
+        self.single_ids = array('q')
+        self.single_keys = []
+        # last block added, while it is not known whether it starts a run
+        self.open_key = None
+        self.open_id = -1
+        self.count = 0
+
+    """
+        Splits a key into the key without its last index and its last index,
+        or into the whole key and None if its last index is not an int.
+    """
+    def split(self, key):
+        if len(key) > 1 and type(key[-1]) is int:
+            return key[:-1], key[-1]
+        return key, None
+
+    def get(self, key, default=None):
+        prefix, last = self.split(key)
+        if last is not None:
+            runs = self.prefixes.get(prefix)
+            if runs is not None:
+                if type(runs) is not int:
+                    position = bisect_right(runs[0], last) - 1
+                    runs = runs[1][position] if position >= 0 else -1
+                if runs >= 0:
+                    start = self.run_starts[runs]
+                    if start <= last < start + self.run_lengths[runs]:
+                        return self.run_ids[runs] + last - start
+        bId = self.singles.get(key)
+        if bId is not None:
+            return bId
+        if key == self.open_key:
+            return self.open_id
+        return default
+
+    def __getitem__(self, key):
+        bId = self.get(key)
+        if bId is None:
+            raise KeyError(key)
+        return bId
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __setitem__(self, key, bId):
+        last_id = self.open_id if self.open_key is not None else -1
+        if len(self.run_ids):
+            last_id = max(last_id, self.run_ids[-1] + self.run_lengths[-1] - 1)
+        if bId <= last_id:
+            raise ValueError("block {} is added after block {}".format(bId, last_id))
+        prefix, last = self.split(key)
+        if self.open_key is not None:
+            open_prefix, open_last = self.split(self.open_key)
+            if (last is not None and open_last is not None and open_prefix == prefix
+                    and last == open_last + 1 and bId == self.open_id + 1):
+                self.add_run(prefix, open_last, self.open_id)
+                self.open_key = None
+            else:
+                self.singles[self.open_key] = self.open_id
+                self.single_ids.append(self.open_id)
+                self.single_keys.append(self.open_key)
+                self.open_key = key
+                self.open_id = bId
+        elif (last is not None and len(self.run_ids) and self.run_prefixes[-1] == prefix
+                and last == self.run_starts[-1] + self.run_lengths[-1]
+                and bId == self.run_ids[-1] + self.run_lengths[-1]):
+            self.run_lengths[-1] += 1
+        else:
+            self.open_key = key
+            self.open_id = bId
+        self.count += 1
+
+    """
+        Adds a run of two blocks, whose keys have the given prefix and last
+        indices start and start + 1, to the runs and to those of its prefix.
+    """
+    def add_run(self, prefix, start, bId):
+        run = len(self.run_ids)
+        self.run_prefixes.append(prefix)
+        self.run_starts.append(start)
+        self.run_ids.append(bId)
+        self.run_lengths.append(2)
+        runs = self.prefixes.get(prefix)
+        if runs is None:
+            self.prefixes[prefix] = run
+            return
+        if type(runs) is int:
+            runs = [array('q', [self.run_starts[runs]]), array('q', [runs])]
+            self.prefixes[prefix] = runs
+        position = bisect_right(runs[0], start)
+        runs[0].insert(position, start)
+        runs[1].insert(position, run)
+
+    """
+        Returns the key of the block with the given id, or None if there is
+        none.
+    """
+    def key_of(self, bId):
+        run = bisect_right(self.run_ids, bId) - 1
+        if run >= 0 and bId < self.run_ids[run] + self.run_lengths[run]:
+            return self.run_prefixes[run] + (self.run_starts[run] + bId - self.run_ids[run],)
+        position = bisect_left(self.single_ids, bId)
+        if position < len(self.single_ids) and self.single_ids[position] == bId:
+            return self.single_keys[position]
+        if self.open_key is not None and bId == self.open_id:
+            return self.open_key
+        return None
+
+    def __len__(self):
+        return self.count
+
+    """ Yields the keys of the blocks in increasing order of their ids """
+    def __iter__(self):
+        position = 0
+        for run in range(len(self.run_ids)):
+            first = self.run_ids[run]
+            while position < len(self.single_ids) and self.single_ids[position] < first:
+                yield self.single_keys[position]
+                position += 1
+            prefix = self.run_prefixes[run]
+            start = self.run_starts[run]
+            for last in range(start, start + self.run_lengths[run]):
+                yield prefix + (last,)
+        yield from self.single_keys[position:]
+        if self.open_key is not None:
+            yield self.open_key
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for key in self:
+            yield key, self[key]
+
+"""
+    A replacement for the block_contents dictionary of a QBF object that
+    keeps the blocks in parallel arrays indexed by block id, in the style of
+    a CSR matrix: the bodies of all blocks are stored one after the other in
+    a single array of literals, and each block has the offset and length of
+    its body, a byte with the code of its attribute and the index of its
+    grouping. Blocks are read back as Block objects built on demand, and
+    changes to them are stored again by assigning them to their id, as for
+    a dictionary. The output and the passes over the gates read the bodies
+    as slices of the literals instead, through parts, and write them with
+    replace, without building Block objects. A new body takes the place of
+    the old one when it fits, and the literals are compacted when more than
+    half of them are unused.
+    The names of the blocks are not stored: they are given back by the
+    function key_of from their ids, the one of the BlockTable of the QBF.
+    Attribute codes are given by each store, 0 meaning no attribute. The
+    cardinality constraints get a code the first time they are stored, and
+    the codes take two bytes once there are too many of them for one.
+"""
+class CompactBlockStore:
+
+    def __init__(self, key_of):
+        self.key_of = key_of
+        self.base = None
+        self.literals = array('i')
+        # literals left unused by the bodies that were replaced
+        self.unused = 0
+        self.offsets = array('q')
+        self.lengths = array('i')
+        self.attributes = bytearray()
+        self.absent = ABSENT
+        self.attribute_codes = [None] + list(Operator) + list(Quantifier)
+        self.attribute_indices = dict([(a, code) for code, a in enumerate(self.attribute_codes)])
+        self.groups = array('i')
+        self.group_names = []
+        self.group_codes = {}
+        self.count = 0
+
+    def slot(self, bId):
+        if self.base is None or bId < self.base or bId - self.base >= len(self.attributes):
+            return -1
+        slot = bId - self.base
+        return -1 if self.attributes[slot] == self.absent else slot
+
+    def attribute_code(self, attribute):
+        try:
+            return self.attribute_indices[attribute]
+        except KeyError:
+            pass
+        code = len(self.attribute_codes)
+        if code == self.absent:
+            if self.absent == ABSENT_WIDE:
+                raise ValueError("too many different attributes for a compact block store")
+            self.attributes = array('H', [ABSENT_WIDE if a == ABSENT else a for a in self.attributes])
+            self.absent = ABSENT_WIDE
+        self.attribute_codes.append(attribute)
+        self.attribute_indices[attribute] = code
+        return code
+
+    def group_code(self, grp):
+        if grp is None:
+            return -1
+        if grp not in self.group_codes:
+            self.group_codes[grp] = len(self.group_names)
+            self.group_names.append(grp)
+        return self.group_codes[grp]
+
+    def __setitem__(self, bId, block):
+        self.put(bId, block.get_body(), block.get_attribute(), block.get_group())
+
+    """
+        Stores a block given its body, its attribute and its grouping.
+    """
+    def put(self, bId, body, attribute, grp):
+        if self.base is None:
+            self.base = bId
+        if bId < self.base:
+            print("BLOCK ERROR: block {} cannot be stored before block {}.".format(bId, self.base))
+            exit()
+        # leave empty slots for ids that are not blocks
+        while bId - self.base >= len(self.attributes):
+            self.offsets.append(len(self.literals))
+            self.lengths.append(0)
+            self.attributes.append(self.absent)
+            self.groups.append(-1)
+        slot = bId - self.base
+        if self.attributes[slot] == self.absent:
+            self.count += 1
+            self.offsets[slot] = len(self.literals)
+            self.lengths[slot] = 0
+        self.groups[slot] = self.group_code(grp)
+        self.replace(bId, body, attribute)
+
+    """
+        Replaces the body and the attribute of a stored block, keeping its
+        grouping. The new body is written over the old one when it fits or
+        when the old one is the last of the literals, and appended otherwise.
+    """
+    def replace(self, bId, body, attribute):
+        slot = bId - self.base
+        offset = self.offsets[slot]
+        length = self.lengths[slot]
+        if len(body) <= length:
+            self.literals[offset:offset + len(body)] = array('i', body)
+            self.unused += length - len(body)
+        elif offset + length == len(self.literals):
+            del self.literals[offset:]
+            self.literals.extend(body)
+        else:
+            self.offsets[slot] = len(self.literals)
+            self.literals.extend(body)
+            self.unused += length
+        self.lengths[slot] = len(body)
+        self.attributes[slot] = self.attribute_code(attribute)
+        if self.unused > len(self.literals) // 2:
+            self.compact()
+
+    """
+        Moves the bodies of the blocks next to each other, dropping the
+        literals left unused.
+    """
+    def compact(self):
+        literals = array('i')
+        for slot in range(len(self.attributes)):
+            offset = self.offsets[slot]
+            self.offsets[slot] = len(literals)
+            literals.extend(self.literals[offset:offset + self.lengths[slot]])
+        self.literals = literals
+        self.unused = 0
+
+    """
+        Returns the body of a block, as a slice of the literals, and its
+        attribute. The slice is a copy rather than a memoryview, which would
+        keep the literals from growing while it is alive.
+    """
+    def parts(self, bId):
+        slot = self.slot(bId)
+        if slot < 0:
+            raise KeyError(bId)
+        offset = self.offsets[slot]
+        return self.literals[offset:offset + self.lengths[slot]], self.attribute_codes[self.attributes[slot]]
+
+    """
+        Returns the name and the grouping of a block.
+    """
+    def header(self, bId):
+        slot = self.slot(bId)
+        if slot < 0:
+            raise KeyError(bId)
+        group = self.groups[slot]
+        return self.key_of(bId), self.group_names[group] if group >= 0 else None
+
+    def __getitem__(self, bId):
+        body, attribute = self.parts(bId)
+        name, grp = self.header(bId)
+        return Block(name, bId, body.tolist(), grp, attribute)
+
+    def __contains__(self, bId):
+        return self.slot(bId) >= 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for slot in range(len(self.attributes)):
+            if self.attributes[slot] != self.absent:
+                yield self.base + slot
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for bId in self:
+            yield self[bId]
+
+    def items(self):
+        for bId in self:
+            yield bId, self[bId]
+
+    def get(self, bId, default=None):
+        return self[bId] if bId in self else default
+
+#==============================================================================
+#========================= Vectorized where clauses ===========================
+#==============================================================================
+
+# Conditions are only vectorized when the ranges of the indices give at least
+# this many candidate tuples, since importing NumPy takes longer than
+# evaluating a few hundred conditions one by one.
+VECTORIZED_TUPLES_MIN = 1 << 12
+# and never for more candidate tuples than this, to bound the memory used
+VECTORIZED_TUPLES_MAX = 1 << 24
+
+VECTORIZED_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod)
+# the ones that can overflow, made through checked_operation
+CHECKED_OPERATIONS = {
+    "Add": lambda left, right: left + right,
+    "Sub": lambda left, right: left - right,
+    "Mult": lambda left, right: left * right,
+}
+# integer results are only trusted up to this size, to leave room for the
+# rounding of the float results they are checked with
+CHECKED_LIMIT = 2.0 ** 62
+VECTORIZED_COMPARISONS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+"""
+    Returns the node of a NumPy expression computing the given expression
+    for whole arrays of index values, or raises a ValueError if it uses
+    anything other than arithmetic, comparisons and indexing of parameters.
+    Chained comparisons and the boolean operators, which only work on
+    single values, become & and | of masks, and x[i][j] becomes x[i, j].
+    Additions, subtractions and products become calls to checked_operation,
+    as integer arrays wrap around silently where Python ints do not.
+    The boolean operators are only allowed where the value of the
+    expression is used as a truth value, as a mask is not their operand.
+"""
+def vectorize_node(node, boolean=False):
+    if isinstance(node, ast.BoolOp) and boolean:
+        operator = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        masks = [mask_node(vectorize_node(value, True)) for value in node.values]
+        result = masks[0]
+        for mask in masks[1:]:
+            result = ast.BinOp(result, operator, mask)
+        return result
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not) and boolean:
+        return ast.UnaryOp(ast.Invert(), mask_node(vectorize_node(node.operand, True)))
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        return ast.UnaryOp(node.op, vectorize_node(node.operand))
+    elif isinstance(node, ast.BinOp) and type(node.op).__name__ in CHECKED_OPERATIONS:
+        operands = [ast.Constant(type(node.op).__name__), vectorize_node(node.left), vectorize_node(node.right)]
+        return ast.Call(ast.Name("__checked", ast.Load()), operands, [])
+    elif isinstance(node, ast.BinOp) and isinstance(node.op, VECTORIZED_OPERATORS):
+        return ast.BinOp(vectorize_node(node.left), node.op, vectorize_node(node.right))
+    elif isinstance(node, ast.Compare) and all([isinstance(op, VECTORIZED_COMPARISONS) for op in node.ops]):
+        operands = [vectorize_node(node.left)] + [vectorize_node(c) for c in node.comparators]
+        result = None
+        for i in range(len(node.ops)):
+            comparison = ast.Compare(operands[i], [node.ops[i]], [operands[i + 1]])
+            result = comparison if result is None else ast.BinOp(result, ast.BitAnd(), comparison)
+        return result
+    elif isinstance(node, ast.Subscript):
+        indices = []
+        while isinstance(node, ast.Subscript):
+            # a boolean array would be taken as a mask by NumPy
+            if isinstance(node.slice, (ast.Slice, ast.Tuple, ast.Compare, ast.BoolOp)):
+                raise ValueError(node.slice)
+            indices.insert(0, vectorize_node(node.slice))
+            node = node.value
+        if not isinstance(node, ast.Name):
+            raise ValueError(node)
+        return ast.Subscript(vectorize_node(node), ast.Tuple(indices, ast.Load()), ast.Load())
+    elif isinstance(node, ast.Name) and not node.id.startswith("__"):
+        return ast.Name(node.id, ast.Load())
+    elif isinstance(node, ast.Constant) and type(node.value) in [int, float, bool]:
+        return node
+    raise ValueError(node)
+
+def mask_node(node):
+    return ast.Compare(node, [ast.NotEq()], [ast.Constant(0)])
+
+"""
+    Applies an operation of CHECKED_OPERATIONS to arrays or numbers, on
+    64-bit integers for the integer and boolean ones, as Python would on
+    ints. Raises an OverflowError if some integer result could be out of
+    range, which the float results tell, so that the expression is then
+    evaluated one tuple at a time.
+"""
+def checked_operation(operator, left, right):
+    numpy = get_numpy()
+    operands = []
+    for operand in [left, right]:
+        operand = numpy.asarray(operand)
+        if operand.dtype.kind not in "biuf" or (operand.dtype.kind == "u" and operand.dtype.itemsize == 8):
+            raise OverflowError(operand.dtype)
+        if operand.dtype.kind in "biu":
+            operand = operand.astype(numpy.int64)
+        operands.append(operand)
+    result = CHECKED_OPERATIONS[operator](*operands)
+    if result.dtype.kind == "i" and result.size:
+        floats = CHECKED_OPERATIONS[operator](*[operand.astype(numpy.float64) for operand in operands])
+        if numpy.abs(floats).max() >= CHECKED_LIMIT:
+            raise OverflowError(operator)
+    return result
+
+"""
+    Compiles the vectorized version of an expression, or returns None if it
+    cannot be vectorized.
+"""
+def compile_vectorized(expr, boolean):
+    try:
+        tree = ast.parse(expr.strip(), mode="eval")
+        tree = ast.Expression(vectorize_node(tree.body, boolean))
+        return compile(ast.fix_missing_locations(tree), "<vectorized expression>", "eval")
+    except (SyntaxError, ValueError, RecursionError):
+        return None
+
+#==============================================================================
+#============================= Sparse adjacency ===============================
+#==============================================================================
+
+"""
+    Recognises a condition selecting the nonzero entries of a row of a
+    matrix parameter, like `edges[i-1][j-1] == 1` for the index j. Returns
+    the name of the matrix, the code of the row, the shift from the index
+    to the column and the comparison made with the entry, an (operator,
+    constant) pair or None if the entry is used as a truth value, or None
+    if the condition is not of this form.
+"""
+def adjacency_pattern(expr, index):
+    try:
+        node = ast.parse(expr.strip(), mode="eval").body
+    except (SyntaxError, ValueError, RecursionError):
+        return None
+    test = None
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and isinstance(node.ops[0], (ast.Eq, ast.NotEq)):
+        constant = node.comparators[0]
+        if not isinstance(constant, ast.Constant) or type(constant.value) not in [int, float, bool]:
+            return None
+        test = ("==" if isinstance(node.ops[0], ast.Eq) else "!=", constant.value)
+        node = node.left
+    if not isinstance(node, ast.Subscript) or not isinstance(node.value, ast.Subscript):
+        return None
+    matrix, row, column = node.value.value, node.value.slice, node.slice
+    if not isinstance(matrix, ast.Name) or isinstance(row, (ast.Slice, ast.Tuple)):
+        return None
+    if any([isinstance(n, ast.Name) and n.id == index for n in ast.walk(row)]):
+        return None
+    shift = None
+    if isinstance(column, ast.Name) and column.id == index:
+        shift = 0
+    elif (isinstance(column, ast.BinOp) and isinstance(column.op, (ast.Add, ast.Sub))
+          and isinstance(column.left, ast.Name) and column.left.id == index
+          and isinstance(column.right, ast.Constant) and type(column.right.value) is int):
+        shift = column.right.value if isinstance(column.op, ast.Add) else -column.right.value
+    if shift is None:
+        return None
+    code = compile(ast.fix_missing_locations(ast.Expression(row)), "<expression>", "eval")
+    return matrix.id, code, shift, test
+
+"""
+    Returns the sorted positions of the entries of a row passing the test of
+    an adjacency pattern, or None if the row is not a list of entries.
+"""
+def adjacency_columns(row, test):
+    if isinstance(row, SparseRow) and not adjacency_test(0, test):
+        return sorted([c for c, entry in row.entries.items() if adjacency_test(entry, test)])
+    numpy = get_numpy() if type(row).__module__.startswith("numpy") else None
+    if numpy is not None and isinstance(row, numpy.ndarray):
+        if row.ndim != 1 or row.dtype.kind not in "biuf":
+            return None
+        return numpy.flatnonzero(adjacency_test(row, test)).tolist()
+    if type(row) not in [list, tuple, SparseRow]:
+        return None
+    if test is None:
+        return [c for c, entry in enumerate(row) if entry]
+    elif test[0] == "==":
+        return [c for c, entry in enumerate(row) if entry == test[1]]
+    return [c for c, entry in enumerate(row) if entry != test[1]]
+
+def adjacency_test(entry, test):
+    if test is None:
+        return entry != 0 if type(entry).__module__.startswith("numpy") else bool(entry)
+    return entry == test[1] if test[0] == "==" else entry != test[1]
+
+"""
+    Tells if a value is a matrix whose rows can be indexed for adjacency
+    patterns: a list of rows, a matrix read from an edge list or a
+    two-dimensional NumPy array.
+"""
+def is_matrix(value):
+    if type(value) in [list, tuple, AdjacencyMatrix]:
+        return True
+    numpy = get_numpy() if type(value).__module__.startswith("numpy") else None
+    return numpy is not None and isinstance(value, numpy.ndarray) and value.ndim == 2
+
+#==============================================================================
+#================================= Data files =================================
+#==============================================================================
+
+"""
+    A row of an AdjacencyMatrix. It holds its nonzero entries only, but is
+    indexed and iterated over like a list of all its entries.
+"""
+class SparseRow:
+
+    __slots__ = ("size", "entries")
+
+    def __init__(self, size):
+        self.size = size
+        # column -> entry, for the nonzero entries
+        self.entries = {}
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, column):
+        if column < 0:
+            column += self.size
+        if not 0 <= column < self.size:
+            raise IndexError("row index out of range")
+        return self.entries.get(column, 0)
+
+    def __iter__(self):
+        return (self.entries.get(column, 0) for column in range(self.size))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+"""
+    A square matrix read from an edge list, indexed like a list of lists.
+    Only the nonzero entries are stored, so a graph with millions of edges
+    takes memory in proportion to them.
+"""
+class AdjacencyMatrix:
+
+    def __init__(self, size):
+        self.rows = [SparseRow(size) for _ in range(size)]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, row):
+        return self.rows[row]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __repr__(self):
+        edges = sum([len(row.entries) for row in self.rows])
+        return "<{}x{} adjacency matrix with {} entries>".format(len(self.rows), len(self.rows), edges)
+
+# Expressions that may be numbers or lists of numbers, read as JSON
+NUMERIC_LITERAL = re.compile(r"[-+0-9.eE,\[\]\s]+")
+
+# Format of the data files with each extension, the rest are edge lists
+DATA_FORMATS = {".npy": "npy", ".csv": "csv", ".json": "json"}
+
+"""
+    A value read from a file, as in 'value: edges from "graph.txt";'. The
+    file is only read when the value is first set, and then kept, so that
+    the instances of a sweep share it.
+"""
+class DataFile:
+
+    def __init__(self, file_name, form=None):
+        self.file_name = file_name
+        self.format = form or DATA_FORMATS.get(path.splitext(file_name)[1].lower(), "edges")
+        self.value = None
+
+    def __repr__(self):
+        return "\"{}\" as {}".format(self.file_name, self.format)
+
+    """
+        Returns the value in the file: a read-only memory-mapped NumPy array
+        for .npy files, the list of rows of a CSV file with its numbers
+        converted, the contents of a JSON file, or an AdjacencyMatrix for an
+        edge list.
+    """
+    def load(self):
+        if self.value is not None:
+            return self.value
+        if self.format == "npy":
+            numpy = get_numpy()
+            if numpy is None:
+                print("VALUE ERROR: NumPy is needed to read the data file {}.".format(self.file_name))
+                exit()
+            try:
+                self.value = numpy.load(self.file_name, mmap_mode="r", allow_pickle=False)
+            except OSError:
+                print("FILE ERROR: the data file {} does not exist or could not be opened.".format(self.file_name))
+                exit()
+            except ValueError:
+                print("VALUE ERROR: the data file {} is not a valid .npy file.".format(self.file_name))
+                exit()
+            return self.value
+
+        try:
+            f = open(self.file_name, "r", newline="")
+        except OSError:
+            print("FILE ERROR: the data file {} does not exist or could not be opened.".format(self.file_name))
+            exit()
+        with f:
+            try:
+                if self.format == "json":
+                    self.value = load(f)
+                elif self.format == "csv":
+                    self.value = [[data_number(cell) for cell in row] for row in csv.reader(f) if row]
+                else:
+                    self.value = read_edges(f, self.format == "undirected-edges")
+            except ValueError as e:
+                print("VALUE ERROR: the data file {} could not be read as {}: {}.".format(self.file_name, self.format, e))
+                exit()
+        return self.value
+
+"""
+    Converts a cell of a CSV file to an int or a float if it is a number.
+"""
+def data_number(cell):
+    cell = cell.strip()
+    try:
+        return int(cell)
+    except ValueError:
+        pass
+    try:
+        return float(cell)
+    except ValueError:
+        return cell
+
+"""
+    Reads an edge list, with one edge "u v" or weighted edge "u v w" per
+    line, into an AdjacencyMatrix whose vertices are numbered from 1 like
+    the indices of the definitions, so that the edge "u v" is the entry
+    [u-1][v-1]. Lines starting with # or % are comments. If undirected is
+    set, every edge is also added in the opposite direction.
+    The matrix has as many rows as the greatest vertex of the edges, or as
+    the number of vertices given by a header line "p NAME vertices [edges]"
+    as in the DIMACS graph format, whose "e u v" edge lines and "c" comment
+    lines are also read, so that the last vertices may have no edges.
+"""
+def read_edges(f, undirected=False):
+    edges = []
+    size = 0
+    for number, line in enumerate(f):
+        fields = line.split()
+        if not fields or fields[0][0] in "#%" or fields[0] == "c":
+            continue
+        if fields[0] == "p":
+            if len(fields) not in [3, 4] or not fields[2].isdigit():
+                raise ValueError("line {} is not a header p NAME vertices [edges]".format(number + 1))
+            size = max(size, int(fields[2]))
+            continue
+        if fields[0] == "e":
+            fields = fields[1:]
+        if len(fields) not in [2, 3]:
+            raise ValueError("line {} is not an edge".format(number + 1))
+        u, v = int(fields[0]), int(fields[1])
+        if u < 1 or v < 1:
+            raise ValueError("line {} has a vertex lower than 1".format(number + 1))
+        edges.append((u - 1, v - 1, data_number(fields[2]) if len(fields) == 3 else 1))
+        size = max(size, u, v)
+    matrix = AdjacencyMatrix(size)
+    for u, v, weight in edges:
+        matrix.rows[u].entries[v] = weight
+        if undirected:
+            matrix.rows[v].entries[u] = weight
+    return matrix
+
 #==============================================================================
 #============================= QBF representation =============================
 #==============================================================================
 
 class QBF:
+
+    # code objects of the expressions evaluated so far, keyed by their text
+    compiled_expressions = {}
+    # vectorized code objects, or None, keyed by their text and whether they
+    # are conditions
+    vectorized_expressions = {}
     
-    def __init__(self):
+    """
+        Creates an empty QBF. If compact is set, the blocks are kept in a
+        CompactBlockStore instead of a dictionary of Block objects, and their
+        ids in a BlockTable instead of a dictionary. The cardinality
+        constraints are expanded with the given encoding, one of the
+        CARDINALITY_ENCODINGS.
+    """
+    def __init__(self, compact=False, cardinality="sequential"):
 
         self.values = {}
+        self.namespace = {}
+        # name -> (value, its NumPy array or None), for vectorized conditions
+        self.vector_values = {}
+        # conditions -> the plan in which iterate applies them
+        self.condition_plans = {}
+        # (name, test) -> (value, the columns of each of its rows)
+        self.adjacency_indices = {}
         
         self.name = ""
         self.format = None
@@ -228,10 +1218,16 @@ class QBF:
         self.parameters = []
         
         self.idCounter = 0
-        self.variables = {}
-        self.blocks = {}
-        self.block_contents = {}
+        self.variables = VariableTable()
+        self.blocks = BlockTable() if compact else {}
+        # names of the declared variables, telling in which table to look up
+        # the key of a brick
+        self.variable_names = set()
+        self.block_contents = CompactBlockStore(self.blocks.key_of) if compact else {}
         self.groupings = {}
+        # ids of the blocks with a cardinality constraint, not expanded yet
+        self.cardinality_blocks = []
+        self.cardinality_encoding = cardinality
 
         self.final = None
 
@@ -239,8 +1235,10 @@ class QBF:
         self.QDIMACS_str = None
         self.non_prenex_QCIR_str = None
 
-        self.QCIR_blackboard = ""
-        self.QCIR_bb_contents = set()
+        self.auxCounter = 0
+        # highest id in the outputs, when prune_and_renumber has numbered
+        # the blocks that are not written after all the others
+        self.emittedCounter = None
     
     # ======================== Name ========================
     def get_name(self):
@@ -277,16 +1275,35 @@ class QBF:
     
     def set_values(self, newValues):
         self.values = newValues
+        self.namespace = dict(newValues)
     
     def get_value(self, name):
         try: 
             return self.values[name]
         except:
-            print("VALUE ERROR: Value for {} does not exist.".format(paramName))
+            print("VALUE ERROR: Value for {} does not exist.".format(name))
             exit()
     
+    """
+        Sets a value given by an expression, or by the DataFile it is read
+        from. Numbers and lists of numbers, which Python and JSON read
+        alike, are read as JSON, much faster than evaluating them.
+    """
     def add_value(self, name, expression):
-        self.values[name] = self.evaluate(expression)
+        if isinstance(expression, DataFile):
+            self.set_value(name, expression.load())
+        elif NUMERIC_LITERAL.fullmatch(expression):
+            try:
+                value = loads(expression)
+            except ValueError:
+                value = self.evaluate(expression)
+            self.set_value(name, value)
+        else:
+            self.set_value(name, self.evaluate(expression))
+
+    def set_value(self, name, value):
+        self.values[name] = value
+        self.namespace[name] = value
     
     # ===================== Parameters =====================
     def get_parameters(self):
@@ -318,23 +1335,64 @@ class QBF:
         try:
             return self.variables[normVarName]
         except:
-            print("VARIABLE ERROR: Variable {} has not been declared.".format(normVarName))
+            print("VARIABLE ERROR: Variable {} has not been declared.".format(readable_name(normVarName)))
             exit()
 
     def add_variables(self, varName, varIndices=[], varRanges=[]):        
         if varIndices and varRanges:
+            array = self.get_variable_array(varName, varIndices, varRanges)
+            if array and array.size >= DENSE_VARIABLES_MIN:
+                self.save_variable_array(array)
+                return
             for valued_indices in self.iterate(varRanges):
                 self.save_variable(self.normalize_name(varName, varIndices, valued_indices)) 
         else:
             self.save_variable(self.normalize_name(varName, varIndices))
+
+    """
+        Returns the VariableArray of a declaration if its variables form a
+        box: every ranged index appears once in the name, and no range
+        depends on another index. Otherwise, returns None and the variables
+        are declared one by one.
+    """
+    def get_variable_array(self, varName, varIndices, varRanges):
+        rangeIndices = [r[0] for r in varRanges]
+        if len(set(rangeIndices)) != len(rangeIndices) or len(set(varIndices)) != len(varIndices):
+            return None
+        if any([ix not in varIndices for ix in rangeIndices]):
+            return None
+        for r in varRanges:
+            for expr in r[1]:
+                if any([n in rangeIndices for n in self.compile_expression(expr).co_names]):
+                    return None
+        key = self.normalize_name(varName, varIndices)
+        literals = [(pos + 1, key[pos + 1]) for pos in range(len(varIndices)) if varIndices[pos] not in rangeIndices]
+        ranges = []
+        for ix, (lim1, lim2) in varRanges:
+            lo = self.evaluate(lim1)
+            hi = self.evaluate(lim2)
+            if type(lo) is not int or type(hi) is not int:
+                return None
+            ranges.append((varIndices.index(ix) + 1, lo, hi))
+        return VariableArray(varName, len(key), literals, ranges, self.idCounter + 1)
+
+    def save_variable_array(self, array):
+        clash = self.variables.overlap(array)
+        if clash is not None:
+            print("VARIABLE ERROR: Variable {} is being declared more than once!".format(readable_name(clash)))
+            exit()
+        self.variables.add_array(array)
+        self.variable_names.add(array.name)
+        self.idCounter = self.idCounter + array.size
             
     def save_variable(self, normVarName):
         if normVarName in self.variables:
-            print("VARIABLE ERROR: Variable {} is being declared more than once!".format(normVarName))
+            print("VARIABLE ERROR: Variable {} is being declared more than once!".format(readable_name(normVarName)))
             exit()
         else:
             self.idCounter = self.idCounter + 1
             self.variables[normVarName] = self.idCounter
+            self.variable_names.add(normVarName[0])
             
     # ===================== Blocks =======================
     def get_block(self, blockId):
@@ -347,64 +1405,132 @@ class QBF:
     def add_blocks(self, definitions, conditions, grouping=None):
         # a block definition looks like:
         # [('X', ['i', 'j']), [((sign, name), indices), ...]]
+        # When the ranges of the left indices do not depend on other indices,
+        # the condition space is walked only once: every tuple of valued
+        # indices is assigned to the block named by its left-hand values, and
+        # the bodies of all the blocks are built in that single pass.
         ids_for_grouping = []
+        if len(definitions) > 1:
+            all_values = list(self.iterate(conditions))
         for definition in definitions:
             left = definition[0]
             bricks = definition[1]
-            name = left[0]
-            for values in self.iterate(conditions):
-                left_values = values.copy()
-                substitutedIndices = self.substitute(left[1], left_values)
-                new_left = dict()
-                for ix in left_values:
-                    if ix in left[1]:
-                        new_left[ix] = left_values[ix]
-                left_values = new_left
-                blockName = self.normalize_name(name, substitutedIndices)
-                if self.is_defined(blockName):
-                    continue
-                else:
-                    self.save_block(blockName)
-                    ids_for_grouping.append(self.get_brick_id(blockName))
-                
-                contents = []
-                cs = set()
-                for i in range(len(bricks)):
+            tuples = all_values if len(definitions) > 1 else self.iterate(conditions)
+            # left values -> new block (or None if it was already defined)
+            new_blocks = {}
+            if self.has_closed_left_indices(left[1], conditions):
+                for values in tuples:
+                    left_values = tuple([values[ix] for ix in left[1] if ix in values])
+                    try:
+                        new_block = new_blocks[left_values]
+                    except KeyError:
+                        new_block = self.start_block(left, bricks, values, ids_for_grouping)
+                        new_blocks[left_values] = new_block
+                    if new_block:
+                        self.add_bricks(new_block, bricks, values)
+            else:
+                for values in tuples:
+                    left_values = tuple([values[ix] for ix in left[1] if ix in values])
+                    if left_values in new_blocks:
+                        continue
+                    new_block = self.start_block(left, bricks, values, ids_for_grouping)
+                    new_blocks[left_values] = new_block
+                    if new_block:
+                        fixed = dict([(ix, values[ix]) for ix in left[1] if ix in values])
+                        for valuedIndices in self.iterate(conditions, fixed):
+                            self.add_bricks(new_block, bricks, valuedIndices)
 
-                    if bricks[i][0] == "all blocks in":
-                        contents.append(self.get_bricks_in_grouping(bricks[i][1]))
-                    else:
-                        contents.append([])
-
-                for i in range(len(bricks)):     
-                    for valuedIndices in self.iterate(conditions, left_values):
-                        brick = bricks[i]
-                        if brick[0] != "all blocks in":
-                            bSign = brick[0][0]
-                            bName = brick[0][1]
-                            indices = self.substitute(brick[1], left_values, valuedIndices)
-                            brickId = self.get_brick_id(self.normalize_name(bName, indices,  brick[1]))
-                            brickIdWithSign = int(bSign + str(brickId))
-                            if brickIdWithSign not in cs:
-                                contents[i].append(brickIdWithSign)
-                                cs.add(brickIdWithSign)
-                contents = [elem for b in contents for elem in b]
-                self.save_block_contents(blockName, contents, grouping)
+            for new_block in new_blocks.values():
+                if new_block:
+                    self.save_block_contents(new_block[0], self.merge_bricks(new_block, bricks), grouping)
 
         self.save_grouping(grouping, ids_for_grouping)
 
+    """
+        Checks whether the ranges of the left-hand indices of a block
+        definition only depend on parameters and other left-hand indices. In
+        that case, the tuples making up the body of a block are exactly those
+        of the condition space that agree with its left-hand values.
+    """
+    def has_closed_left_indices(self, leftIndices, conditions):
+        indices = set([c[0] for c in conditions if c[0] != 'other'])
+        for condition in conditions:
+            if condition[0] in leftIndices:
+                for expr in condition[1]:
+                    names = self.compile_expression(expr).co_names
+                    if any([n in indices and n not in leftIndices for n in names]):
+                        return False
+        return True
+
+    """
+        Declares the block named by the left-hand side of a definition for the
+        given values. Returns its partial body, with a list of brick ids and a
+        set of seen ids per brick, or None if the block was already defined.
+    """
+    def start_block(self, left, bricks, values, ids_for_grouping):
+        blockName = (left[0], *self.substitute(left[1], values))
+        if self.is_defined(blockName):
+            return None
+        self.save_block(blockName)
+        ids_for_grouping.append(self.get_brick_id(blockName))
+        contents = []
+        for brick in bricks:
+            if brick[0] == "all blocks in":
+                contents.append(self.get_bricks_in_grouping(brick[1]))
+            else:
+                contents.append([])
+        return [blockName, contents, [set() for brick in bricks]]
+
+    def add_bricks(self, new_block, bricks, values):
+        contents = new_block[1]
+        seen = new_block[2]
+        for i in range(len(bricks)):
+            brick = bricks[i]
+            if brick[0] != "all blocks in":
+                bSign = brick[0][0]
+                bName = brick[0][1]
+                # substituted indices are already values, see normalize_name
+                brickId = self.get_brick_id((bName, *self.substitute(brick[1], values)))
+                brickIdWithSign = -brickId if bSign else brickId
+                if brickIdWithSign not in seen[i]:
+                    contents[i].append(brickIdWithSign)
+                    seen[i].add(brickIdWithSign)
+
+    def merge_bricks(self, new_block, bricks):
+        contents = new_block[1]
+        body = []
+        cs = set()
+        for i in range(len(bricks)):
+            if bricks[i][0] == "all blocks in":
+                body.extend(contents[i])
+            else:
+                for brickIdWithSign in contents[i]:
+                    if brickIdWithSign not in cs:
+                        body.append(brickIdWithSign)
+                        cs.add(brickIdWithSign)
+        return body
+
     def get_brick_id(self, normName):
-        if normName in self.variables:
-            return self.variables[normName]
-        elif normName in self.blocks:
-            return self.blocks[normName]
+        if normName[0] in self.variable_names:
+            # the dictionary of the variable table is used directly, as this
+            # is the hottest lookup of the generation
+            brickId = self.variables.explicit.get(normName)
+            if brickId is None and self.variables.arrays:
+                brickId = self.variables.array_lookup(normName)
+            if brickId is None:
+                # a block may share its name with some variables
+                brickId = self.blocks.get(normName)
+        else:
+            brickId = self.blocks.get(normName)
+        if brickId is not None:
+            return brickId
         else:
-            print("BRICK ERROR: Block or variable {} has not been declared.".format(normName))
+            print("BRICK ERROR: Block or variable {} has not been declared.".format(readable_name(normName)))
             exit()
 
     def save_block(self, normBlockName):
         if normBlockName in self.blocks:
-            print("BLOCK ERROR: Block {} is being declared more than once!".format(normBlockName))
+            print("BLOCK ERROR: Block {} is being declared more than once!".format(readable_name(normBlockName)))
             exit()
         else:
             self.idCounter = self.idCounter + 1
@@ -428,27 +1554,490 @@ class QBF:
         block = self.get_block(blockId)
         block.add_attribute(att)
         self.block_contents[blockId] = block
+        if isinstance(block.get_attribute(), Cardinality):
+            self.cardinality_blocks.append(blockId)
     
     # ===================== Attributes =====================
     def add_attribute(self, blockName, blockIndices, att):
         normName = self.normalize_name(blockName, blockIndices)
         blockId = self.get_brick_id(normName)
-        self.update_block_with_attribute(blockId, att)
+        self.update_block_with_attribute(blockId, self.evaluate_attribute(att))
         
     def add_attributes_grp(self, grp, att):
         if grp not in self.groupings:
             print("GROUPING ERROR: grouping name {} is not defined".format(grp))
             exit()
         else:
+            att = self.evaluate_attribute(att)
             for block_id in self.groupings[grp]:
                 self.update_block_with_attribute(block_id, att)
+
+    """
+        Cardinality constraints come from the parser as a (kind, expression)
+        pair; returns them as a Cardinality with the value of the bound.
+        Other attributes are returned unchanged.
+    """
+    def evaluate_attribute(self, att):
+        if not isinstance(att, tuple):
+            return att
+        kind, expr = att
+        k = self.evaluate(expr)
+        if type(k) is not int or k < 0:
+            print("ATTRIBUTE ERROR: the bound {} of a cardinality constraint is not a non-negative integer.".format(expr))
+            exit()
+        return Cardinality(kind, k)
                 
     # =================== Final block ======================
     def save_final_block(self, name, indices):
         normName = self.normalize_name(name, indices)
         blockId = self.get_brick_id(normName)
         self.final = blockId
-    
+
+    # ============== Cardinality constraints ===============
+
+    """
+        Replaces the cardinality constraints of the blocks by AND and OR gates
+        over their bricks, which work in any polarity and need no auxiliary
+        variables. The encodings are circuit versions of:
+          - sequential: a counter, where gate s(i, j) tells whether at least j
+            of the first i bricks are true. Linear in the bricks times k.
+          - totalizer: unary counters of halves of the bricks, merged in a
+            balanced tree.
+          - ladder: for at most (exactly) one, the prefix disjunctions
+            y(i) of the bricks, with no brick true after y(i - 1).
+          - commander: for at most (exactly) one, the bricks split in groups
+            of three, at most one true in each group and, recursively, in the
+            disjunctions of the groups.
+        The ladder and commander encodings fall back to the sequential one
+        for other constraints. The new gates are named after the block. The
+        encoding is the one the QBF was created with unless one is given.
+    """
+    def expand_cardinality_gates(self, encoding=None):
+        if encoding is None:
+            encoding = self.cardinality_encoding
+        for bId in self.cardinality_blocks:
+            block = self.block_contents[bId]
+            constraint = block.get_attribute()
+            # a name that no block of the definition can have
+            name = (block.get_name()[0] + " " + encoding,) + tuple(block.get_name()[1:])
+            lits = block.get_body()
+
+            if constraint.k == 1 and constraint.kind != "atleast" and encoding in ["ladder", "commander"]:
+                if encoding == "ladder":
+                    conditions, alo = self.ladder_encoding(name, lits)
+                else:
+                    conditions, alo = self.commander_encoding(name, lits)
+                if constraint.kind == "exactly":
+                    conditions.append(alo)
+            else:
+                if constraint.kind == "atleast":
+                    bound = constraint.k
+                else:
+                    bound = constraint.k + 1
+                if encoding == "totalizer":
+                    counts = self.totalizer_encoding(name, lits, min(bound, len(lits)))
+                else:
+                    counts = self.sequential_encoding(name, lits, min(bound, len(lits)))
+
+                def at_least(j):
+                    return counts[j] if j < len(counts) else False
+
+                if constraint.kind == "atleast":
+                    conditions = [at_least(constraint.k)]
+                elif constraint.kind == "atmost":
+                    conditions = [self.negate(at_least(constraint.k + 1))]
+                else:
+                    conditions = [at_least(constraint.k), self.negate(at_least(constraint.k + 1))]
+
+            # the block becomes the conjunction of the conditions
+            if any(c is False for c in conditions):
+                operator, body = Operator.OR, []
+            else:
+                operator, body = Operator.AND, [c for c in conditions if c is not True]
+            self.block_contents[bId] = Block(block.get_name(), bId, body, block.get_group(), operator)
+        self.cardinality_blocks = []
+
+    """
+        Adds a gate, returning its id. Gates are given the name of the block
+        they encode with their id as an extra index.
+    """
+    def new_gate(self, name, operator, body):
+        self.idCounter = self.idCounter + 1
+        key = name + (self.idCounter,)
+        self.blocks[key] = self.idCounter
+        self.block_contents[self.idCounter] = Block(key, self.idCounter, body, None, Operator(operator))
+        return self.idCounter
+
+    # The constraints are built from literals and constants (True and False),
+    # which are folded instead of becoming gates. Since True == 1, constants
+    # are told apart from literals by identity.
+
+    def negate(self, lit):
+        return (not lit) if type(lit) is bool else -lit
+
+    def gate_and(self, name, lits):
+        if any(lit is False for lit in lits):
+            return False
+        lits = [lit for lit in lits if lit is not True]
+        if not lits:
+            return True
+        return lits[0] if len(lits) == 1 else self.new_gate(name, "and", lits)
+
+    def gate_or(self, name, lits):
+        if any(lit is True for lit in lits):
+            return True
+        lits = [lit for lit in lits if lit is not False]
+        if not lits:
+            return False
+        return lits[0] if len(lits) == 1 else self.new_gate(name, "or", lits)
+
+    """
+        Returns the list of counts of a sequential counter over the literals:
+        the constant or literal telling whether at least j of them are true,
+        for j from 0 to bound, which is at most the number of literals.
+    """
+    def sequential_encoding(self, name, lits, bound):
+        counts = [True] + [False] * bound
+        for lit in lits:
+            for j in range(bound, 0, -1):
+                counts[j] = self.gate_or(name, [counts[j], self.gate_and(name, [lit, counts[j - 1]])])
+        return counts
+
+    """
+        Returns the counts of the literals, like sequential_encoding, adding
+        up the counts of the two halves of the literals. The bound is at most
+        the number of literals.
+    """
+    def totalizer_encoding(self, name, lits, bound):
+        if len(lits) <= 1:
+            return [True] + list(lits[:bound])
+        # the counts of each half only go up to its number of literals
+        half = len(lits) // 2
+        left = self.totalizer_encoding(name, lits[:half], min(bound, half))
+        right = self.totalizer_encoding(name, lits[half:], min(bound, len(lits) - half))
+        counts = [True]
+        for j in range(1, bound + 1):
+            counts.append(self.gate_or(name, [self.gate_and(name, [left[p], right[j - p]])
+                                              for p in range(max(0, j - len(right) + 1), min(j, len(left) - 1) + 1)]))
+        return counts
+
+    """
+        Returns the conditions for at most one of the literals to be true, and
+        the literal telling whether at least one is, of the ladder encoding.
+    """
+    def ladder_encoding(self, name, lits):
+        conditions = []
+        ladder = False
+        for lit in lits:
+            conditions.append(self.gate_or(name, [self.negate(ladder), -lit]))
+            ladder = self.gate_or(name, [ladder, lit])
+        return conditions, ladder
+
+    """
+        Returns the conditions for at most one of the literals to be true, and
+        the literal telling whether at least one is, of the commander encoding.
+    """
+    def commander_encoding(self, name, lits):
+        conditions = []
+        if len(lits) <= 4:
+            for i in range(len(lits)):
+                for j in range(i + 1, len(lits)):
+                    conditions.append(self.gate_or(name, [-lits[i], -lits[j]]))
+            return conditions, self.gate_or(name, list(lits))
+        commanders = []
+        for i in range(0, len(lits), 3):
+            group_conditions, commander = self.commander_encoding(name, lits[i:i + 3])
+            conditions.extend(group_conditions)
+            commanders.append(commander)
+        group_conditions, alo = self.commander_encoding(name, commanders)
+        conditions.extend(group_conditions)
+        return conditions, alo
+
+    # ==================== Simplifying =====================
+
+    """
+        Simplifies the gates of a prenex formula, from the variables up to
+        the output. Gates with a single operand are replaced by it, AND and
+        OR gates absorb the operands with the same operator that nothing
+        else uses, duplicate operands are removed, and gates with opposite
+        operands or with constant operands are folded. A gate that becomes
+        constant is stored with an empty body, and(), which is true, or or(),
+        which is false, and its value is propagated to the gates using it.
+    """
+    def simplify(self):
+        self.expand_cardinality_gates()
+        prefix_root, output = self.get_block_parts(self.final)[0]
+        root = abs(output)
+        if root not in self.block_contents:
+            return
+
+        fanout = {root: 1}
+        for _, body, _ in self.iter_gate_parts(root):
+            for lit in body:
+                if abs(lit) in self.block_contents:
+                    fanout[abs(lit)] = fanout.get(abs(lit), 0) + 1
+
+        # gate id -> constant value, or literal that replaces the gate
+        constants = {}
+        replacements = {}
+        # gates whose operands are literals, with their operator
+        operators = {}
+
+        def operand(lit):
+            ref = abs(lit)
+            if ref in constants:
+                return constants[ref] != (lit < 0)
+            if ref in replacements:
+                return replacements[ref] if lit > 0 else -replacements[ref]
+            return lit
+
+        for gId, body, attribute in self.iter_gate_parts(root):
+            operator = self.gate_operator(gId, body, attribute)
+            operands = [operand(lit) for lit in body]
+            result = self.simplify_gate(operator, operands, operators, fanout)
+
+            if type(result) is bool:
+                constants[gId] = result
+                operator = "and" if result else "or"
+                self.set_block_parts(gId, [], Operator(operator))
+            elif type(result) is int:
+                replacements[gId] = result
+                if abs(result) in fanout:
+                    fanout[abs(result)] += fanout[gId] - 1
+            else:
+                new_operator, new_body = result
+                operators[gId] = new_operator
+                if new_operator != operator or new_body != list(body):
+                    self.set_block_parts(gId, new_body, Operator(new_operator))
+
+        if root in replacements:
+            lit = replacements[root] if output > 0 else -replacements[root]
+            if lit > 0 and lit in self.block_contents:
+                self.set_block_parts(self.final, [prefix_root, lit], self.get_block_parts(self.final)[1])
+            else:
+                # the output must be a gate
+                self.set_block_parts(root, [replacements[root]], Operator.AND)
+        self.QCIR_str = None
+        self.QDIMACS_str = None
+
+    """
+        Simplifies a gate given its operator and its operands, which are
+        either literals or constants (booleans). Returns the constant or the
+        literal equivalent to the gate, or its new (operator, body) pair.
+    """
+    def simplify_gate(self, operator, operands, operators, fanout):
+        def neg(o):
+            return (not o) if type(o) is bool else -o
+
+        if operator == "and" or operator == "or":
+            return self.simplify_junction(operator, operands, operators, fanout)
+        elif operator == "imp":
+            a, b = operands
+            if type(a) is bool or type(b) is bool or a == b or a == -b:
+                return self.simplify_junction("or", [neg(a), b], operators, fanout)
+        elif operator == "xor" or operator == "dimp":
+            a, b = operands
+            # a dimp b is the negation of a xor b
+            negated = operator == "dimp"
+            if type(a) is bool and type(b) is bool:
+                return (a != b) != negated
+            elif type(a) is bool or type(b) is bool:
+                constant, lit = (a, b) if type(a) is bool else (b, a)
+                return neg(lit) if constant != negated else lit
+            elif a == b or a == -b:
+                return (a != b) != negated
+        else:
+            c, t, e = operands
+            if type(c) is bool:
+                return t if c else e
+            elif t == e and type(t) is type(e):
+                return t
+            elif type(t) is bool and type(e) is bool:
+                return c if t else -c
+            elif type(t) is bool:
+                return self.simplify_junction("or", [c, e], operators, fanout) if t else \
+                       self.simplify_junction("and", [-c, e], operators, fanout)
+            elif type(e) is bool:
+                return self.simplify_junction("or", [-c, t], operators, fanout) if e else \
+                       self.simplify_junction("and", [c, t], operators, fanout)
+        return operator, operands
+
+    """
+        Simplifies an AND or an OR gate. Operands that are gates with the same
+        operator and no other user are replaced by their own operands.
+    """
+    def simplify_junction(self, operator, operands, operators, fanout):
+        # the constant that decides the gate: false for AND, true for OR
+        absorbing = operator == "or"
+        lits = []
+        seen = set()
+        stack = list(reversed(operands))
+        while stack:
+            o = stack.pop()
+            if type(o) is bool:
+                if o == absorbing:
+                    return absorbing
+                continue
+            if o > 0 and operators.get(o) == operator and fanout.get(o) == 1:
+                stack.extend(reversed(self.get_block_parts(o)[0]))
+                continue
+            if -o in seen:
+                return absorbing
+            if o not in seen:
+                seen.add(o)
+                lits.append(o)
+        if not lits:
+            return not absorbing
+        if len(lits) == 1:
+            return lits[0]
+        return operator, lits
+
+    # =================== Gate sharing =====================
+
+    """
+        Merges the gates of a prenex formula that compute the same function
+        of the same operands. The gates are visited in topological order, so
+        the operands of a gate have already been replaced by their
+        representatives, and a gate is keyed by its operator and body, sorted
+        for the commutative operators. Gates equal to an earlier one are
+        replaced by it wherever they are used, and are no longer reachable
+        from the output. Their ids are left unused unless -prune renumbers.
+    """
+    def hash_gates(self):
+        self.expand_cardinality_gates()
+        prefix_root, output = self.get_block_parts(self.final)[0]
+        if abs(output) not in self.block_contents:
+            return
+
+        representatives = {}
+        table = {}
+        for gId, body, attribute in self.iter_gate_parts(abs(output)):
+            operator = self.gate_operator(gId, body, attribute)
+            new_body = [representatives.get(lit, lit) if lit > 0 else -representatives.get(-lit, -lit) for lit in body]
+            if operator in COMMUTATIVE_OPERATORS:
+                key = (operator, tuple(sorted(new_body)))
+            else:
+                key = (operator, tuple(new_body))
+            if key in table:
+                representatives[gId] = table[key]
+                continue
+            table[key] = gId
+            if new_body != list(body):
+                self.set_block_parts(gId, new_body, attribute)
+
+        if abs(output) in representatives:
+            output = representatives[output] if output > 0 else -representatives[-output]
+            self.set_block_parts(self.final, [prefix_root, output], self.get_block_parts(self.final)[1])
+        self.QCIR_str = None
+        self.QDIMACS_str = None
+
+    # ====================== Pruning =======================
+
+    """
+        Removes everything that does not reach the output of a prenex
+        formula, and renumbers the rest densely. The variables that occur
+        in the matrix come first, in prefix order followed by the free ones,
+        then the gates in topological order, so the ids in the output are
+        exactly 1..n. Quantified variables that do not occur in the matrix
+        are dropped, as well as the quantifier blocks left empty; the prefix
+        blocks and the final block are numbered after the gates.
+    """
+    def prune_and_renumber(self):
+        self.expand_cardinality_gates()
+        prefix_root, output = self.get_block_parts(self.final)[0]
+
+        # gates reachable from the output, and variables they use
+        gates = []
+        used = {}
+        if abs(output) in self.block_contents:
+            for gate in self.iter_gate_parts(abs(output)):
+                gates.append(gate)
+                for lit in gate[1]:
+                    if abs(lit) not in self.block_contents:
+                        used[abs(lit)] = True
+        else:
+            used[abs(output)] = True
+
+        new_ids = {}
+        for _, lits in self.iter_quant_blocks(prefix_root):
+            for lit in lits:
+                if abs(lit) in used and abs(lit) not in new_ids:
+                    new_ids[abs(lit)] = len(new_ids) + 1
+        for var in used:
+            if var not in new_ids:
+                new_ids[var] = len(new_ids) + 1
+        nVariables = len(new_ids)
+        for gId, _, _ in gates:
+            new_ids[gId] = len(new_ids) + 1
+        emitted = len(new_ids)
+
+        def renumber(lit):
+            return new_ids[lit] if lit > 0 else -new_ids[-lit]
+
+        # (old id, new body, attribute) of the blocks kept, in the new order
+        new_blocks = [(gId, [renumber(lit) for lit in body], attribute) for gId, body, attribute in gates]
+
+        # prefix blocks, keeping only the variables and blocks not left empty
+        for bId, body, attribute in self.iter_gate_parts(prefix_root):
+            if bId in new_ids:
+                continue
+            body = [renumber(lit) for lit in body if abs(lit) in new_ids]
+            if not body:
+                if bId != prefix_root:
+                    continue
+                # an empty prefix quantifies nothing
+                attribute = None
+            new_ids[bId] = len(new_ids) + 1
+            new_blocks.append((bId, body, attribute))
+
+        new_ids[self.final] = len(new_ids) + 1
+        new_blocks.append((self.final, [new_ids[prefix_root], renumber(output)], self.get_block_parts(self.final)[1]))
+
+        # rebuild the tables with the new ids
+        variable_keys = {}
+        for key, varId in self.variables.items():
+            if varId in new_ids:
+                variable_keys[new_ids[varId]] = key
+        variables = VariableTable()
+        for varId in range(1, nVariables + 1):
+            if varId in variable_keys:
+                variables[variable_keys[varId]] = varId
+        self.variables = variables
+        self.variable_names = set(key[0] for key in variables.keys())
+
+        old_contents = self.block_contents
+        if isinstance(old_contents, CompactBlockStore):
+            # new ids are given in the order of new_blocks
+            self.blocks = BlockTable()
+            self.block_contents = CompactBlockStore(self.blocks.key_of)
+            for bId, body, attribute in new_blocks:
+                name, grp = old_contents.header(bId)
+                self.blocks[name] = new_ids[bId]
+                self.block_contents.put(new_ids[bId], body, attribute, grp)
+        else:
+            self.blocks = {}
+            self.block_contents = {}
+            for bId, body, attribute in new_blocks:
+                block = old_contents[bId]
+                self.blocks[block.get_name()] = new_ids[bId]
+                self.block_contents[new_ids[bId]] = Block(block.get_name(), new_ids[bId], body, block.get_group(), attribute)
+        self.groupings = {grp: [new_ids[bId] for bId in ids if bId in new_ids]
+                          for grp, ids in self.groupings.items()}
+
+        self.final = new_ids[self.final]
+        self.idCounter = len(new_ids)
+        self.emittedCounter = emitted
+        self.QCIR_str = None
+        self.QDIMACS_str = None
+
+    """
+        Returns the highest id that the outputs may contain.
+    """
+    def get_emitted_counter(self):
+        if self.emittedCounter is None:
+            return self.idCounter
+        return self.emittedCounter
+
     # ===================== Outputs ========================
 
     # _______________________ QCIR _________________________
@@ -457,67 +2046,128 @@ class QBF:
         Generates a string with the formula written in QCIR.
     """
     def get_QCIR_string(self):
+        if not self.QCIR_str:
+            self.generate_QCIR()
+        return self.QCIR_str
+
+    def generate_QCIR(self):
+        self.QCIR_str = "".join(self.iter_QCIR_lines())
+        return self.QCIR_str
+
+    """
+        Returns a generator yielding the lines of the formula written in QCIR,
+        each of them ending in a newline. Gates are produced lazily, as the
+        DAG of blocks is traversed, so the text is never held in memory.
+    """
+    def iter_QCIR_lines(self):
+        self.expand_cardinality_gates()
         if self.format == Format.circuit_NON_PRENEX:
             print("FORMAT ERROR: the given formula is in non-prenex format; the only possible output is non-prenex QCIR.")
             exit()
-        if self.format == Format.CNF or self.format == Format.circuit_PRENEX:
-            if not self.QCIR_str:
-                self.generate_QCIR()
-            return self.QCIR_str
+        return self.generate_QCIR_lines()
 
-    def generate_QCIR(self):
+    def generate_QCIR_lines(self):
+        # auxiliary gates are numbered after all the variables and blocks
+        self.auxCounter = self.get_emitted_counter()
 
         # opening line
-        in_qcir_str = "#QCIR-G14\n"
+        yield "#QCIR-G14\n"
 
         final = self.final
-        final_contents = self.block_contents[final].get_body()
+        final_contents = self.get_block_parts(final)[0]
         
         # add quantifiers:
-        prefix = [self.block_contents[final_contents[0]]]
-        for brick in prefix:
-            in_qcir_str += self.process_quant_block(brick)
+        for q_line in self.iter_quant_lines(final_contents[0]):
+            yield q_line
 
         # add output gate
-        in_qcir_str += "output({})\n".format(final_contents[1])
+        yield "output({})\n".format(final_contents[1])
 
         # write gates
-        self.write_on_blackboard(self.block_contents[final_contents[1]])
-        in_qcir_str += self.QCIR_blackboard
+        for str_gate in self.iter_gates(final_contents[1]):
+            yield str_gate + "\n"
 
-        self.QCIR_str = in_qcir_str
-        return in_qcir_str
+    """
+        Writes the formula in QCIR on a file-like object, gate by gate.
+    """
+    def write_QCIR(self, sink):
+        sink.writelines(self.iter_QCIR_lines())
 
-    def block_to_string_gates(self, block):
-        operator = block.get_attribute_str()
-        output = str(block.get_id())
-        body = block.get_body()
+    """
+        Returns the body and the attribute of the block with the given id.
+        The blocks of a CompactBlockStore are read straight from its arrays,
+        the body being a slice of its literals, without building a Block.
+    """
+    def get_block_parts(self, bId):
+        if isinstance(self.block_contents, CompactBlockStore):
+            return self.block_contents.parts(bId)
+        block = self.block_contents[bId]
+        return block.get_body(), block.get_attribute()
 
-        if operator == "imp":
-            gate_str = output + " = " + "or" + "("
-            imp1 = ""
-            imp2 = ""
+    """
+        Replaces the body and the attribute of the block with the given id,
+        keeping its name and its grouping.
+    """
+    def set_block_parts(self, bId, body, attribute):
+        if isinstance(self.block_contents, CompactBlockStore):
+            self.block_contents.replace(bId, body, attribute)
+        else:
+            block = self.block_contents[bId]
+            self.block_contents[bId] = Block(block.get_name(), bId, body, block.get_group(), attribute)
+
+    """
+        Returns the name and the grouping of the block with the given id.
+    """
+    def get_block_header(self, bId):
+        if isinstance(self.block_contents, CompactBlockStore):
+            return self.block_contents.header(bId)
+        block = self.block_contents[bId]
+        return block.get_name(), block.get_group()
+
+    """
+        Returns the operator of the gate block with the given id, body and
+        attribute, checking that it can be applied to the number of bricks in
+        its body. Blocks without an operator are only valid when they have at
+        most one brick, and are read as an OR.
+    """
+    def gate_operator(self, gId, body, attribute):
+        operator = str(attribute.value) if attribute else "None"
+
+        if operator == "imp" and len(body) != 2:
+            print("OPERATOR ERROR: Cannot use operator {} on block {} because the number of bricks is not two.".format("→ (implication)", readable_name(self.get_block_header(gId)[0])))
+            exit()
+        elif operator == "dimp" and len(body) != 2:
+            print("OPERATOR ERROR: Cannot use operator {} on block {} because the number of bricks is not two.".format("↔ (double implication)", readable_name(self.get_block_header(gId)[0])))
+            exit()
+        elif operator == "None":
+            if len(body) >= 2:
+                print("OPERATOR ERROR: Block {} has been assigned no valid operator.".format(readable_name(self.get_block_header(gId)[0])))
+                exit()
+            else:
+                operator = "or"
+        elif operator == "xor" and len(body) != 2:
+            print("OPERATOR ERROR: Cannot use operator {} on block {} because the number of bricks is not two.".format("⊕ (XOR)", readable_name(self.get_block_header(gId)[0])))
+            exit()
+        elif operator == "ite" and len(body) != 3:
+            print("OPERATOR ERROR: Cannot use operator {} on block {} because the number of bricks is not three.".format("⤙ (if-then-else)", readable_name(self.get_block_header(gId)[0])))
+            exit()
+
+        return operator
 
-            if len(body) != 2:
-                print("OPERATOR ERROR: Cannot use operator {} on block {} because the number of bricks is not two.".format("→ (implication)", block.get_name()))
-                exit()
+    def block_to_string_gates(self, gId, body, attribute):
+        operator = self.gate_operator(gId, body, attribute)
+        output = str(gId)
 
+        if operator == "imp":
             imp1 = body[0]
             imp2 = body[1]
-
-            gate_str += str(-1 * int(imp1)) + ", " + str(imp2) + ")"
+            gate_str = output + " = " + "or" + "(" + str(-1 * int(imp1)) + ", " + str(imp2) + ")"
             return [gate_str]
         elif operator == "dimp":
-            aux1 = self.idCounter + 1
-            self.idCounter += 1
-            aux2 = self.idCounter + 1
-            self.idCounter += 1
-            imp1 = ""
-            imp2 = ""
-
-            if len(body) != 2:
-                print("OPERATOR ERROR: Cannot use operator {} on block {} because the number of bricks is not two.".format("↔ (double implication)", block.get_name()))
-                exit()
+            aux1 = self.auxCounter + 1
+            self.auxCounter += 1
+            aux2 = self.auxCounter + 1
+            self.auxCounter += 1
 
             imp1 = body[0]
             imp2 = body[1]
@@ -526,69 +2176,92 @@ class QBF:
             left =  str(aux1) + " = or(" + str(-1 * int(imp1)) + ", " + str(imp2) + ")"
             right = str(aux2) + " = or(" + str(-1 * int(imp2)) + ", " + str(imp1) + ")"
             return [left, right, gate_str]
-
         else:
-            if operator == "None":
-                if len(body) >= 2:
-                    print("OPERATOR ERROR: Block {} has been assigned no valid operator.".format(block.get_name()))
-                    exit()
-                else:
-                    operator = "or"
-            elif operator == "xor" and len(body) != 2:
-                print("OPERATOR ERROR: Cannot use operator {} on block {} because the number of bricks is not two.".format("⊕ (XOR)", block.get_name()))
-                exit()
-            elif operator == "ite" and len(body) != 3:
-                print("OPERATOR ERROR: Cannot use operator {} on block {} because the number of bricks is not three.".format("⊕ (XOR)", block.get_name()))
-                exit()
+            return [output + " = " + operator + "(" + ", ".join([str(lit) for lit in body]) + ")"]
 
-            body = str(body)
-            return [output + " = " + operator + "(" + body[1:-1] + ")"]
+    """
+        Yields the (id, body, attribute) triples of the gates of the DAG
+        rooted at the block with the given id, in topological order. The
+        traversal keeps its own stack of (gate, remaining operands) entries,
+        so the nesting depth of the blocks is not bounded by Python's
+        recursion limit.
+    """
+    def iter_gate_parts(self, root):
+        processed = set()
+        body, attribute = self.get_block_parts(root)
+        stack = [(root, body, attribute, iter(body))]
+        on_stack = set([root])
+        while stack:
+            current, body, attribute, operands = stack[-1]
+            # first make sure the operands of the gate have been written
+            for operand in operands:
+                operand = abs(operand)
+                if (operand in self.block_contents) and not (operand in processed):
+                    if operand in on_stack:
+                        print("BLOCK ERROR: block {} is defined in terms of itself.".format(readable_name(self.get_block_header(operand)[0])))
+                        exit()
+                    on_stack.add(operand)
+                    operand_body, operand_attribute = self.get_block_parts(operand)
+                    stack.append((operand, operand_body, operand_attribute, iter(operand_body)))
+                    break
+            else:
+                stack.pop()
+                on_stack.discard(current)
+                # mark this gate as processed
+                processed.add(current)
+                yield current, body, attribute
 
-    def write_on_blackboard(self, block):
-        # first make sure the operands of the gate are in the blackboard
-        for operand in block.get_body():
-            operand = abs(operand)
-            if (operand in self.block_contents) and not (operand in self.QCIR_bb_contents):
-                self.write_on_blackboard(self.block_contents[operand])
-        # mark this gate as processed
-        self.QCIR_bb_contents.add(block.get_id())
-        # write the gate on the blackboard
-        for str_gate in self.block_to_string_gates(block):
-            self.QCIR_blackboard += str_gate + "\n"
+    def iter_gates(self, root):
+        for gId, body, attribute in self.iter_gate_parts(root):
+            for str_gate in self.block_to_string_gates(gId, body, attribute):
+                yield str_gate
 
+    """
+        Yields the quantifier lines of the prefix rooted at the block with the
+        given id.
+    """
+    def iter_quant_lines(self, root):
+        for quantifier, lits in self.iter_quant_blocks(root):
+            q_block_str = "{}(".format(quantifier.value)
+            q_block_str += "".join([str(lit) + ", " for lit in lits])
+            yield q_block_str[:-2] + ")\n"
+
+    """
+        Yields the (quantifier, literals) pairs of the prefix rooted at the
+        block with the given id, from the outermost to the innermost.
+    """
+    def iter_quant_blocks(self, root):
+        stack = [root]
+        while stack:
+            body, attribute = self.get_block_parts(stack.pop())
+            if attribute:
+                yield attribute, self.flatten_bricks(body)
+            else:
+                stack.extend(reversed(body))
 
-    # Deprecated, don't use!
     def process_quant_block(self, block):
-        if block.has_attribute():
-            q_block_str = "{}(".format(block.get_attribute_str())
-            q_block_str += self.to_str_list(block.get_body())
-            q_block_str = q_block_str[:-2] + ")\n"
-            return q_block_str
-        else:
-            body = block.get_body()
-            several_str = ""
-            for brick in body:
-                several_str += self.process_quant_block(self.block_contents[brick])
-            return several_str
+        return "".join(self.iter_quant_lines(block.get_id()))
 
-    # Deprecated, don't use!
-    def to_str_list(self, bricks):
-        str_list = ""
-        for brick in bricks:
+    """
+        Flattens a list of bricks into the list of the literals they contain,
+        propagating the signs of nested blocks.
+    """
+    def flatten_bricks(self, bricks):
+        lits = []
+        stack = [(brick, 1) for brick in reversed(bricks)]
+        while stack:
+            brick, sign = stack.pop()
             ref = abs(brick)
-            sign = -1 if brick < 0 else 1
-            if ref in self.variables.values():
-                str_list += str(brick) + ", "
+            if ref not in self.block_contents:
+                lits.append(sign * brick)
             else:
-                block = self.block_contents[ref]
-                body = block.get_body()
-                sub_list = self.to_str_list(body)
-                sub_list = sub_list.split(",")
-                sub_list = sub_list[:-1]
-                for lit in sub_list:
-                    lit_int = int(lit)
-                    str_list += str(sign*lit_int) + ", "
-        return str_list
+                sign = -sign if brick < 0 else sign
+                body = self.get_block_parts(ref)[0]
+                stack.extend([(b, sign) for b in reversed(body)])
+        return lits
+
+    def to_str_list(self, bricks):
+        return "".join([str(lit) + ", " for lit in self.flatten_bricks(bricks)])
 
     # Deprecated, don't use!
     def get_gates_str_list(self, gates):
@@ -668,6 +2341,7 @@ class QBF:
         Generates a string with the formula written in non-prenex QCIR.
     """
     def get_non_prenex_QCIR_string(self):
+        self.expand_cardinality_gates()
         if self.format == Format.CNF or self.format == Format.circuit_PRENEX:
             print("OUTPUT ERROR: Non-prenex QCIR output format unavailable for prenex formulae.")
             exit()
@@ -679,12 +2353,12 @@ class QBF:
     def generate_non_prenex_QCIR(self):
         preamble = "#QCIR-G14\n" + "output({})\n".format(self.final)
 
-        gates = [self.block_contents[self.final]]
+        gates = deque([self.block_contents[self.final]])
         gates_str_list = []
         gate_str = ""
         processed = set()
         while gates:
-            g = gates.pop(0)
+            g = gates.popleft()
             
             if g.get_name() in processed:
                 continue
@@ -732,175 +2406,654 @@ class QBF:
 
     # _______________________ QDIMACS _______________________
     def get_QDIMACS_string(self):
+        if not self.QDIMACS_str:
+            self.QDIMACS_str = "".join(self.iter_QDIMACS_lines())
+        return self.QDIMACS_str
+
+    """
+        Returns a generator yielding the lines of the formula written in
+        QDIMACS. Circuits are translated into CNF with the Tseitin encoding,
+        or with the Plaisted-Greenbaum encoding if polarity is set.
+    """
+    def iter_QDIMACS_lines(self, polarity=False):
+        self.expand_cardinality_gates()
         if self.format == Format.circuit_NON_PRENEX:
             print("FORMAT ERROR: the given formula is in non-prenex format; the only possible output is non-prenex QCIR.")
             exit()
         if self.format == Format.CNF:
-            if not self.QDIMACS_str:
-                self.generate_QDIMACS_from_prenex_QCIR()
-            return self.QDIMACS_str
-
-        elif self.format == Format.circuit_PRENEX:
-            f1 = open("input.qcir", "w")
-            f2 = open("output.qdimacs", "w")
-            f2.close()
-            f1.write(self.get_QCIR_string())
-            f1.close()
-            if not exists("qcir-to-qdimacs.py"):
-                print("CONVERSION ERROR: to convert to QDIMACS William Klieber's qcir-to-qdimacs.py script is needed in this directory. Download it from https://www.wklieber.com/ghostq/qcir-to-qdimacs.py")
-                exit()
+            return self.generate_QDIMACS_from_CNF(polarity)
+        return self.generate_QDIMACS_from_circuit(polarity)
 
-            system("python2 qcir-to-qdimacs.py input.qcir -o output.qdimacs --reclim 25000")
-            f2 = open("output.qdimacs", "r")
-            self.QDIMACS_str = f2.read()
-            f2.close()
-            remove("input.qcir")
-            remove("output.qdimacs")
-            return self.QDIMACS_str
+    """
+        Writes a formula in CNF format directly from its blocks: the OR blocks
+        over variables are the clauses, and the AND blocks above them are
+        flattened. The gates are never rendered as QCIR. If the matrix turns
+        out not to be in CNF, the formula is Tseitin-encoded instead.
+    """
+    def generate_QDIMACS_from_CNF(self, polarity=False):
+        final_contents = self.get_block_parts(self.final)[0]
+        output = final_contents[1]
 
-        elif self.format == Format.circuit_NON_PRENEX:
-            print("Prenexing not yet supported!")
-    
-    def generate_QDIMACS_from_prenex_QCIR(self):
-        # if QCIR was not generated yet, do it
-        if not self.QCIR_str:
-            self.generate_QCIR()
-        
-        split_QCIR = self.QCIR_str.splitlines()
-        qdimacs_str = ""
-        currentQuant = ""
-        currentLine = ""
+        # first pass: check the shape of the matrix and count the clauses
         nClauses = 0
-        for line in split_QCIR:
-            if line.startswith("exists"):
-                lits = self.get_lits_from_line(line)
-                if currentQuant == "e":
-                    for lit in lits:
-                        currentLine += " " + str(lit)
-                else:
-                    if currentLine != "":
-                        qdimacs_str += currentLine + " 0\n"
-                    currentQuant = "e"
-                    currentLine = "e"
-                    for lit in lits:
-                        currentLine += " " + str(lit)
-
-
-            elif line.startswith("forall"):
-                lits = self.get_lits_from_line(line)
-                if currentQuant == "a":
-                    for lit in lits:
-                        currentLine += " " + str(lit)
+        for clause in self.iter_CNF_clauses(output):
+            if clause is None:
+                for line in self.generate_QDIMACS_from_circuit(polarity):
+                    yield line
+                return
+            nClauses += 1
+
+        yield "c Formula Family: {}\n".format(self.get_name())
+        yield "c Values: {}\n".format(self.get_values())
+        yield "p cnf {} {}\n".format(len(self.variables), nClauses)
+        for q, lits in self.get_QDIMACS_prefix(final_contents[0]):
+            yield q + " " + " ".join([str(lit) for lit in lits]) + " 0\n"
+
+        # second pass: write the clauses
+        for clause in self.iter_CNF_clauses(output):
+            yield " ".join([str(lit) for lit in clause]) + " 0\n"
+
+    """
+        Yields the clauses of a matrix in CNF, in the order in which their
+        blocks are reached. A None is yielded for each block that does not
+        fit in a conjunction of clauses.
+    """
+    def iter_CNF_clauses(self, output):
+        if abs(output) not in self.block_contents:
+            yield [output]
+            return
+        if output < 0:
+            yield None
+            return
+        for gId, body, attribute in self.iter_gate_parts(output):
+            operator = self.gate_operator(gId, body, attribute)
+            if operator == "or" and all([abs(lit) not in self.block_contents for lit in body]):
+                yield body
+            elif operator == "and" or (operator == "or" and len(body) == 1):
+                for lit in body:
+                    if abs(lit) not in self.block_contents:
+                        yield [lit]
+                    elif lit < 0:
+                        yield None
+            else:
+                yield None
+
+    """
+        Returns the quantifier blocks of the prefix rooted at the block with
+        the given id as [q, literals] pairs, merging consecutive blocks with
+        the same quantifier. The given extra variables are existentially
+        quantified in the innermost block.
+    """
+    def get_QDIMACS_prefix(self, root, innermost_ids=[]):
+        prefix = []
+        for quantifier, lits in self.iter_quant_blocks(root):
+            q = "e" if quantifier == Quantifier.EXISTS else "a"
+            if not lits:
+                continue
+            if prefix and prefix[-1][0] == q:
+                prefix[-1][1].extend(lits)
+            else:
+                prefix.append([q, lits])
+        if innermost_ids:
+            if prefix and prefix[-1][0] == "e":
+                prefix[-1][1].extend(innermost_ids)
+            else:
+                prefix.append(["e", innermost_ids])
+        return prefix
+
+    """
+        Tseitin encoding of a prenex circuit: every gate gets the variable of
+        its block id, existentially quantified in the innermost block of the
+        prefix, and the clauses defining it. The DAG is traversed twice, once
+        to count the clauses for the header and once to write them, so the
+        clauses are streamed instead of being kept in memory.
+
+        With polarity set, a gate that is only used positively (negatively)
+        only gets the clauses of g -> op(body) (of op(body) -> g), which is
+        enough for the gates of the innermost existential block.
+    """
+    def generate_QDIMACS_from_circuit(self, polarity=False):
+        final_contents = self.get_block_parts(self.final)[0]
+        output = final_contents[1]
+        matrix = []
+        if abs(output) in self.block_contents:
+            matrix = [abs(output)]
+
+        # first pass: gate variables and number of clauses
+        gate_ids = []
+        nClauses = 1
+        for root in matrix:
+            for gId, body, attribute in self.iter_gate_parts(root):
+                gate_ids.append(gId)
+                if not polarity:
+                    nClauses += self.count_gate_clauses(self.gate_operator(gId, body, attribute), body)
+        if polarity:
+            polarities = self.get_polarities(output, gate_ids)
+            for gId in gate_ids:
+                body, attribute = self.get_block_parts(gId)
+                nClauses += self.count_gate_clauses(self.gate_operator(gId, body, attribute), body, polarities[gId])
+
+        prefix = self.get_QDIMACS_prefix(final_contents[0], gate_ids)
+
+        yield "c Formula Family: {}\n".format(self.get_name())
+        yield "c Values: {}\n".format(self.get_values())
+        yield "p cnf {} {}\n".format(self.get_emitted_counter(), nClauses)
+        for q, lits in prefix:
+            yield q + " " + " ".join([str(lit) for lit in lits]) + " 0\n"
+
+        # second pass: the output unit clause and the gate definitions
+        yield "{} 0\n".format(output)
+        for root in matrix:
+            for gId, body, attribute in self.iter_gate_parts(root):
+                clauses = self.block_to_clauses(gId, self.gate_operator(gId, body, attribute), body)
+                if polarity and polarities[gId] != BOTH_POLARITIES:
+                    clauses = self.filter_clauses(gId, clauses, polarities[gId])
+                for clause in clauses:
+                    yield " ".join([str(lit) for lit in clause]) + " 0\n"
+
+    """
+        Returns the polarities in which the gates of the matrix are used, as
+        a dictionary from their ids to POSITIVE, NEGATIVE or BOTH_POLARITIES.
+        The gates are given in topological order, and are visited from the
+        output down, so the polarity of a gate is known before it is passed
+        on to its operands.
+    """
+    def get_polarities(self, output, gate_ids):
+        polarities = dict.fromkeys(gate_ids, 0)
+        if gate_ids:
+            polarities[abs(output)] = POSITIVE if output > 0 else NEGATIVE
+        for gId in reversed(gate_ids):
+            body, attribute = self.get_block_parts(gId)
+            operator = self.gate_operator(gId, body, attribute)
+            both = polarities[gId]
+            flipped = ((both & POSITIVE) << 1) | ((both & NEGATIVE) >> 1)
+            for position, lit in enumerate(body):
+                ref = abs(lit)
+                if ref not in polarities:
+                    continue
+                if operator in ["xor", "dimp"] or (operator == "ite" and position == 0):
+                    polarities[ref] |= BOTH_POLARITIES
+                elif (lit < 0) != (operator == "imp" and position == 0):
+                    polarities[ref] |= flipped
                 else:
-                    if currentLine != "":
-                        qdimacs_str += currentLine + " 0\n"
-                    currentQuant = "a"
-                    currentLine = "a"
-                    for lit in lits:
-                        currentLine += " " + str(lit)
-
-            elif "or" in line:
-                nClauses += 1
-                qdimacs_str += currentLine + " 0\n"
-                currentLine = ""
-                lits = self.get_lits_from_line(line)
-                for lit in lits:
-                    if currentLine != "":
-                        currentLine += " " + lit
-                    else:
-                        currentLine += lit
+                    polarities[ref] |= both
+        return polarities
+
+    """
+        Keeps the clauses of the Tseitin encoding of a gate needed in the
+        given polarity: those with -g encode g -> op(body), and those with g
+        encode op(body) -> g.
+    """
+    def filter_clauses(self, g, clauses, polarity):
+        if polarity == POSITIVE:
+            return [clause for clause in clauses if -g in clause]
+        return [clause for clause in clauses if g in clause]
+
+    def count_gate_clauses(self, operator, body, polarity=BOTH_POLARITIES):
+        if operator == "and" or operator == "or":
+            n = len(body)
+            # an AND has n clauses with -g and one with g, an OR the opposite
+            positive, negative = (n, 1) if operator == "and" else (1, n)
+        elif operator == "imp":
+            positive, negative = 1, 2
+        else:
+            positive, negative = 2, 2
+        return (positive if polarity & POSITIVE else 0) + (negative if polarity & NEGATIVE else 0)
+
+    """
+        Returns the clauses of the Tseitin encoding of a gate block, i.e. the
+        clauses of g <-> op(body), where g is the id of the block and op its
+        operator as given by gate_operator.
+    """
+    def block_to_clauses(self, g, operator, body):
+
+        if operator == "imp":
+            operator = "or"
+            body = [-body[0], body[1]]
+
+        if operator == "and":
+            clauses = [[-g, lit] for lit in body]
+            clauses.append([g] + [-lit for lit in body])
+        elif operator == "or":
+            clauses = [[g, -lit] for lit in body]
+            clauses.append([-g] + list(body))
+        elif operator == "xor":
+            a, b = body
+            clauses = [[-g, a, b], [-g, -a, -b], [g, -a, b], [g, a, -b]]
+        elif operator == "dimp":
+            a, b = body
+            clauses = [[-g, -a, b], [-g, a, -b], [g, a, b], [g, -a, -b]]
+        else:
+            c, t, e = body
+            clauses = [[-g, -c, t], [-g, c, e], [g, -c, -t], [g, c, -e]]
+        return clauses
 
-        qdimacs_str += currentLine + " 0\n"
-        preamble = "c Formula Family: {}\n".format(self.get_name())
-        preamble += "c Values: {}\n".format(self.get_values())
-        preamble += "p cnf {} {}\n".format(len(self.variables), nClauses)
-        self.QDIMACS_str = preamble + qdimacs_str
-        return self.QDIMACS_str
-    
-    def get_lits_from_line(self, line):
-        p1 = line.find("(")
-        p2 = line.find(")")
-        lits = line[p1+1:p2]
-        return lits.split(", ")
-        
     # ================= Additional methods =================
 
+    """
+        Compiles an expression of the definition into a code object. Code
+        objects are cached by the text of the expression, so each backtick
+        expression is only compiled once, no matter how often it is evaluated.
+    """
+    def compile_expression(self, expr):
+        try:
+            return QBF.compiled_expressions[expr]
+        except KeyError:
+            pass
+        try:
+            code = compile(expr.strip(), "<expression>", "eval")
+        except:
+            print("EVALUATION ERROR: unable to evaluate {}".format(expr))
+            exit()
+        QBF.compiled_expressions[expr] = code
+        return code
+
     """
         Evaluates the expression expr bringing into scope the existing
         values. Additional valued variables can be added in extraValues.
+        Values are held by reference in self.namespace, and the extra values
+        take precedence over them.
     """
     def evaluate(self, expr, extraValues={}):
-        variables = [var for var in self.values] + [var for var in extraValues]
-        assigned_values = [val for val in self.values.values()] + [val for val in extraValues.values()]
-        pairs = zip(variables, assigned_values)
-        for p in pairs:
-            assignment = "{} = {}".format(p[0], p[1])
-            try:
-                exec(assignment)
-            except:
-                print("EVALUATION ERROR: unable to execute {}".format(assignment))
-                exit()
-
+        code = self.compile_expression(expr)
         try: 
-            return eval(expr)
+            return eval(code, self.namespace, extraValues)
         except:
             print("EVALUATION ERROR: unable to evaluate {}".format(expr))
             exit()
 
     """
-        Normalizes a variable name given some indices and valued indices.
+        Evaluates an expression as evaluate does, but raises its errors
+        instead of reporting them, for the conditions whose errors are left
+        to be reported later.
+    """
+    def try_evaluate(self, expr, extraValues={}):
+        return eval(self.compile_expression(expr), self.namespace, extraValues)
+
+    """
+        Returns the key identifying a variable or block given its name, its
+        indices and the values of the indices: a (name, index values...)
+        tuple.
+        Indices without a value are taken literally. Index values other than
+        ints are put in the form given by canonical_index, so that x(1) in
+        an attribute or declaration is the same as x(i) with i = 1, while
+        x(01) or x(i) with i = 1.0 are other symbols. The readable name is
+        only built when needed, by readable_name.
     """
     def normalize_name(self, varName, varIndices, valuedIndices={}):
-        varName = varName + '('
+        key = []
         for index in varIndices:
-            varName = varName + ' ' + str(valuedIndices[index]) if index in valuedIndices else varName + ' ' + str(index)
-        varName = varName + ' )'
-        return varName
+            if index in valuedIndices:
+                index = valuedIndices[index]
+            if type(index) is not int:
+                index = canonical_index(index)
+            key.append(index)
+        return (varName, *key)
 
     """
         Iterates over a list of conditions, generating all possible tuples of values
         for the given indices.
+        When NumPy is installed and the ranges give many candidate tuples, the
+        conditions are applied to arrays holding all the candidates at once,
+        up to the first condition that cannot be vectorized. The remaining
+        conditions are then applied to each tuple left, one by one. The
+        tuples are generated in the same order either way.
+        The conditions are first reordered by plan_conditions, so that every
+        filter is applied as soon as the indices it uses have a value.
     """
     def iterate(self, conditions, extra_valued_indices={}):
-        stack = [[{}, 0]]
+        conditions, invariant = self.plan_conditions(conditions, extra_valued_indices)
+        # bounds of the ranges in invariant, evaluated once
+        bounds = {}
+        prefix = None
+        if self.count_candidates(conditions, extra_valued_indices) >= VECTORIZED_TUPLES_MIN:
+            prefix = self.vectorized_prefix(conditions, extra_valued_indices)
+        if prefix is None:
+            return self.iterate_from(conditions, extra_valued_indices, {}, 0, invariant, bounds)
+        return self.iterate_rows(conditions, extra_valued_indices, *prefix, invariant, bounds)
+
+    """
+        Returns the conditions in the order in which iterate applies them,
+        and the positions of the ranges whose bounds do not depend on any
+        index.
+        Each filter is placed right after the ranges of the indices it uses.
+        The ranges keep their written order, so that the tuples are generated
+        in the same order, and are never moved before a filter written before
+        them, as their bounds may fail on the tuples it leaves out.
+        Conditions using an index before its range are left as written, as
+        the index may then be the name of a value, and so are conditions
+        using unknown names, so that their errors are reported exactly when
+        they were before. A filter moved before a range gets the position
+        where it was due as a third element, since it may fail on values that
+        never reached it before.
+        A range followed by a filter on an entry of a matrix parameter, as in
+        `edges[i-1][j-1] == 1` for the range of j, gets the adjacency pattern
+        of the filter as a third element, so that only the columns passing
+        the filter are enumerated. Plans are cached by the text of the
+        conditions.
+    """
+    def plan_conditions(self, conditions, extra_valued_indices):
+        key = (tuple([(c[0], tuple(c[1]) if c[0] != 'other' else c[1]) for c in conditions]), tuple(extra_valued_indices))
+        try:
+            return self.condition_plans[key]
+        except KeyError:
+            pass
+
+        indices = [c[0] for c in conditions if c[0] != 'other']
+        well_ordered = len(set(indices)) == len(indices)
+        uses = []
+        for c in conditions:
+            exprs = [c[1]] if c[0] == 'other' else ([] if c[0] in extra_valued_indices else c[1])
+            names = set()
+            for expr in exprs:
+                try:
+                    names.update(compile(expr.strip(), "<expression>", "eval").co_names)
+                except:
+                    well_ordered = False
+            known = [name in indices or name in self.namespace or hasattr(builtins, name) for name in names]
+            well_ordered = well_ordered and all(known)
+            uses.append(set([name for name in names if name in indices]))
+        invariant = set([p for p in range(len(conditions)) if conditions[p][0] != 'other' and not uses[p]])
+
+        ordered = list(range(len(conditions)))
+        bound = set()
+        for p in range(len(conditions)):
+            well_ordered = well_ordered and uses[p] <= bound
+            if conditions[p][0] != 'other':
+                bound.add(conditions[p][0])
+        if well_ordered and any([c[0] == 'other' for c in conditions]):
+            ordered = []
+            bound = set()
+            pending = list(range(len(conditions)))
+            while pending:
+                ready = [p for p in pending if conditions[p][0] == 'other' and uses[p] <= bound]
+                if not ready:
+                    # the filters written before the first range left all have their indices
+                    ready = [min([p for p in pending if conditions[p][0] != 'other'])]
+                    bound.add(conditions[ready[0]][0])
+                ordered.extend(ready)
+                pending = [p for p in pending if p not in ready]
+
+        planned = [conditions[p] for p in ordered]
+        # a filter moved before a range gets the position where it was due
+        for q in range(len(ordered)):
+            p = ordered[q]
+            if conditions[p][0] == 'other':
+                due = max([ordered.index(r) + 1 for r in range(p) if conditions[r][0] != 'other'] + [0])
+                if due > q:
+                    planned[q] = ['other', conditions[p][1], due]
+        bound = set()
+        for p in range(len(planned)):
+            index = planned[p][0]
+            if index == 'other':
+                continue
+            follower = p + 1
+            while index not in extra_valued_indices and follower < len(planned) and planned[follower][0] == 'other':
+                pattern = adjacency_pattern(planned[follower][1], index)
+                if (pattern is not None and is_matrix(self.namespace.get(pattern[0]))
+                        and all([name in bound or name in self.namespace for name in pattern[1].co_names])):
+                    planned[p] = [index, planned[p][1], pattern]
+                    break
+                follower += 1
+            bound.add(index)
+        plan = (planned, set([ordered.index(p) for p in invariant]))
+        self.condition_plans[key] = plan
+        return plan
+
+    """
+        Returns the number of candidate tuples given by the ranges of the
+        conditions whose bounds do not depend on other indices, or 0 if no
+        condition is a filter.
+    """
+    def count_candidates(self, conditions, extra_valued_indices):
+        if not any([condition[0] == 'other' for condition in conditions]):
+            return 0
+        indices = set([condition[0] for condition in conditions])
+        candidates = 1
+        for condition in conditions:
+            if condition[0] == 'other' or condition[0] in extra_valued_indices:
+                continue
+            code1 = self.compile_expression(condition[1][0])
+            code2 = self.compile_expression(condition[1][1])
+            if any([name in indices for name in code1.co_names + code2.co_names]):
+                continue
+            # errors are left to be reported when the range is reached
+            try:
+                candidates *= max(self.try_evaluate(condition[1][1]) - self.try_evaluate(condition[1][0]) + 1, 0)
+            except Exception:
+                pass
+        return candidates
+
+    """
+        Applies the longest prefix of the conditions that can be vectorized
+        to arrays of candidate tuples. Returns the arrays of the values of
+        the indices in the tuples left, their number and the number of
+        conditions applied, or None if no filter could be vectorized.
+    """
+    def vectorized_prefix(self, conditions, extra_valued_indices):
+        numpy = get_numpy()
+        if numpy is None:
+            return None
+        columns = {}
+        size = 1
+        position = 0
+        filtered = False
+        for condition in conditions:
+            if condition[0] == 'other':
+                mask = self.evaluate_vectorized(condition[1], columns, size, True)
+                if mask is None:
+                    break
+                columns = dict([(index, column[mask]) for index, column in columns.items()])
+                size = int(numpy.count_nonzero(mask))
+                filtered = True
+            elif len(condition) > 2:
+                # the range has an adjacency pattern, only its entries are tried
+                break
+            elif condition[0] in extra_valued_indices:
+                value = extra_valued_indices[condition[0]]
+                if type(value) is not int:
+                    break
+                columns[condition[0]] = numpy.full(size, value, dtype=numpy.int64)
+            else:
+                lim1 = self.evaluate_vectorized(condition[1][0], columns, size, False)
+                lim2 = self.evaluate_vectorized(condition[1][1], columns, size, False)
+                if lim1 is None or lim2 is None or lim1.dtype.kind not in "iu" or lim2.dtype.kind not in "iu":
+                    break
+                counts = numpy.maximum(lim2 - lim1 + 1, 0)
+                total = int(counts.sum())
+                if total > VECTORIZED_TUPLES_MAX:
+                    break
+                # every tuple is repeated once per value of the new index
+                rows = numpy.repeat(numpy.arange(size), counts)
+                starts = numpy.cumsum(counts) - counts
+                column = lim1[rows] + (numpy.arange(total) - starts[rows])
+                columns = dict([(index, column[rows]) for index, column in columns.items()])
+                columns[condition[0]] = column
+                size = total
+            position += 1
+        if not filtered:
+            return None
+        return columns, size, position
+
+    """
+        Evaluates an expression for the arrays of index values, returning an
+        array with a value for each tuple, a mask if the expression is a
+        condition. Returns None if the expression cannot be vectorized or
+        fails, so that it is evaluated one tuple at a time instead.
+    """
+    def evaluate_vectorized(self, expr, columns, size, boolean):
+        numpy = get_numpy()
+        try:
+            code = QBF.vectorized_expressions[(expr, boolean)]
+        except KeyError:
+            code = compile_vectorized(expr, boolean)
+            QBF.vectorized_expressions[(expr, boolean)] = code
+        if code is None:
+            return None
+        scope = {}
+        for name in code.co_names:
+            if name == "__checked":
+                scope[name] = checked_operation
+            elif name in columns:
+                scope[name] = columns[name]
+            elif name in self.namespace and self.vector_value(name) is not None:
+                scope[name] = self.vector_value(name)
+            else:
+                return None
+        try:
+            with numpy.errstate(all="raise"):
+                result = numpy.asarray(eval(code, {"__builtins__": {}}, scope))
+        except Exception:
+            return None
+        if result.dtype.kind not in "biuf":
+            return None
+        if boolean and result.dtype.kind != "b":
+            result = result != 0
+        if result.ndim == 0:
+            return numpy.full(size, result)
+        return result if result.shape == (size,) else None
+
+    """
+        Returns a value as a NumPy array or number for vectorized conditions,
+        or None if it is not a number, a rectangular list of numbers or an
+        array of numbers.
+    """
+    def vector_value(self, name):
+        value = self.namespace[name]
+        cached = self.vector_values.get(name)
+        if cached is not None and cached[0] is value:
+            return cached[1]
+        vector = None
+        if type(value) in [int, float, bool]:
+            vector = int(value) if type(value) is bool else value
+        elif isinstance(value, get_numpy().ndarray):
+            # arrays read from .npy files are used without copying them
+            if value.ndim > 0 and value.dtype.kind in "biuf":
+                vector = value
+        elif type(value) in [list, tuple]:
+            try:
+                vector = get_numpy().asarray(value)
+                if vector.ndim == 0 or vector.dtype.kind not in "biuf":
+                    vector = None
+            except ValueError:
+                vector = None
+        self.vector_values[name] = (value, vector)
+        return vector
+
+    """
+        Generates the tuples left by the vectorized conditions, applying the
+        rest of the conditions to each of them.
+    """
+    def iterate_rows(self, conditions, extra_valued_indices, columns, size, position, invariant=(), bounds=None):
+        indices = list(columns)
+        rows = zip(*[columns[index].tolist() for index in indices]) if indices else [()] * size
+        for row in rows:
+            valuedIndices = dict(zip(indices, row))
+            if position == len(conditions):
+                yield valuedIndices
+            else:
+                yield from self.iterate_from(conditions, extra_valued_indices, valuedIndices, position, invariant, bounds)
+
+    """
+        Generates the tuples of values for the conditions from the given one
+        on, one at a time, extending the given values of the indices. The
+        bounds of the ranges at the invariant positions are only evaluated
+        once, and kept in bounds.
+        A filter failing before the position where it was due lets the tuple
+        through, and its error is only reported if the tuple gets there.
+    """
+    def iterate_from(self, conditions, extra_valued_indices={}, valuedIndices={}, start=0, invariant=(), bounds=None):
+        if bounds is None:
+            bounds = {}
+        stack = deque([[dict(valuedIndices), start, None]])
         while stack:
-            valuedIndices, currentCondition = stack.pop(0)
+            valuedIndices, currentCondition, failed = stack.popleft()
+            if failed is not None and currentCondition >= failed[0]:
+                if not self.evaluate(failed[1], valuedIndices):
+                    continue
+                failed = None
             if currentCondition < len(conditions):
                 condition = conditions[currentCondition]
                 if condition[0] == 'other':
-                    booleanCondition = self.evaluate(condition[1], valuedIndices)
+                    if len(condition) > 2:
+                        try:
+                            booleanCondition = self.try_evaluate(condition[1], valuedIndices)
+                        except Exception:
+                            booleanCondition = True
+                            if failed is None or condition[2] < failed[0]:
+                                failed = (condition[2], condition[1])
+                    else:
+                        booleanCondition = self.evaluate(condition[1], valuedIndices)
                     if booleanCondition:
-                        stack.append([valuedIndices.copy(), currentCondition + 1])
+                        stack.append([valuedIndices.copy(), currentCondition + 1, failed])
                     else:
                         continue
                 else:
                     index = condition[0]
                     if index not in extra_valued_indices:
-                        lim1 = self.evaluate(condition[1][0], valuedIndices)
-                        lim2 = self.evaluate(condition[1][1], valuedIndices)
-                        for ix in range(lim1, lim2 + 1):
+                        if currentCondition in bounds:
+                            lim1, lim2 = bounds[currentCondition]
+                        else:
+                            lim1 = self.evaluate(condition[1][0], valuedIndices)
+                            lim2 = self.evaluate(condition[1][1], valuedIndices)
+                            if currentCondition in invariant:
+                                bounds[currentCondition] = (lim1, lim2)
+                        values = None
+                        if len(condition) > 2:
+                            values = self.adjacent_values(condition[2], lim1, lim2, valuedIndices)
+                        for ix in range(lim1, lim2 + 1) if values is None else values:
                             valuedIndices[index] = ix
-                            stack.append([valuedIndices.copy(), currentCondition + 1])
+                            stack.append([valuedIndices.copy(), currentCondition + 1, failed])
                     else:
                         valuedIndices[index] = extra_valued_indices[index]
-                        stack.append([valuedIndices.copy(), currentCondition + 1])
+                        stack.append([valuedIndices.copy(), currentCondition + 1, failed])
             else:
                 yield valuedIndices
 
     """
-        Substitues indices for values.
+        Returns the values from lim1 to lim2 of an index whose range has an
+        adjacency pattern, for which the entry of the matrix passes the test
+        of the pattern, in increasing order. Returns None when all of them
+        have to be tried, as the row is not a row of the matrix or the range
+        goes past its ends, where the filter wraps around or fails.
+    """
+    def adjacent_values(self, pattern, lim1, lim2, valuedIndices):
+        name, row_code, shift, test = pattern
+        matrix = self.namespace[name]
+        index = self.adjacency_indices.get((name, test))
+        if index is None or index[0] is not matrix:
+            rows = [adjacency_columns(row, test) for row in matrix]
+            lengths = [len(row) if columns is not None else 0 for row, columns in zip(matrix, rows)]
+            index = (matrix, rows, lengths)
+            self.adjacency_indices[(name, test)] = index
+        try:
+            row = eval(row_code, self.namespace, valuedIndices)
+        except Exception:
+            return None
+        if type(row) is not int or not 0 <= row < len(matrix) or index[1][row] is None:
+            return None
+        if type(lim1) is not int or type(lim2) is not int or lim1 + shift < 0 or lim2 + shift >= index[2][row]:
+            return None
+        columns = index[1][row]
+        first = bisect_left(columns, lim1 + shift)
+        last = bisect_right(columns, lim2 + shift)
+        return [column - shift for column in columns[first:last]]
+
+    """
+        Substitues indices for values, in the form they have in keys.
     """    
     def substitute(self, indices, values, extra_values={}):
         subs = []
         for ix in indices:
             if ix in self.values:
-                subs.append(self.values[ix])
+                value = self.values[ix]
             elif ix in values:
-                subs.append(values[ix])
+                value = values[ix]
             elif ix in extra_values:
-                subs.append(extra_values[ix])
+                value = extra_values[ix]
             else:
-                subs.append(int(ix))
+                value = int(ix)
+            subs.append(value if type(value) is int else canonical_index(value))
         return subs
     
     """
@@ -922,12 +3075,12 @@ class QBF:
         
         my_formula = my_formula +  "The formula has the following {} variables, with assigned corresponding numeric identifiers:\n\n".format(len(self.get_variables()))
         for var in self.get_variables():
-            my_formula = my_formula + "    {} --> {}\n".format(var, self.variables[var])
+            my_formula = my_formula + "    {} --> {}\n".format(readable_name(var), self.variables[var])
         my_formula = my_formula + "\n"
         
         my_formula = my_formula +  "The formula has the following {} blocks, with assigned corresponding numeric identifiers and contents:\n\n".format(len(self.blocks))
         for b in self.blocks:
-            my_formula = my_formula + "    {} --> {}, with contents {}\n".format(b, self.blocks[b], self.block_contents[self.blocks[b]].get_body())
+            my_formula = my_formula + "    {} --> {}, with contents {}\n".format(readable_name(b), self.blocks[b], self.block_contents[self.blocks[b]].get_body())
         my_formula = my_formula + "\n"
         
         my_formula = my_formula +  "The formula has the following {} groupings, which contains the following blocks:\n\n".format(len(self.groupings))
@@ -939,14 +3092,48 @@ class QBF:
         for block in self.block_contents:
             my_formula = my_formula + "    Block {}, with attribute {}\n".format(block, self.block_contents[block].get_attribute_str())
         my_formula = my_formula + "\n"
-        my_formula = my_formula + "The output of the formula is determined by the block {}, i.e. {}\n".format(self.final, self.block_contents[self.final].get_name())
+        my_formula = my_formula + "The output of the formula is determined by the block {}, i.e. {}\n".format(self.final, readable_name(self.block_contents[self.final].get_name()))
         my_formula = my_formula + "======================================================\n"
         
         print(my_formula)
 
 
 verbose = False
-formula = QBF()
+
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# LALR parser for the grammar, built once per process by get_parser()
+_parser = None
+# NumPy module, imported by get_numpy(), or False if it is not installed
+_numpy = None
+
+"""
+    Returns the numpy module, or None if it is not installed. NumPy is an
+    optional dependency, only used to vectorize conditions, and it is only
+    imported the first time it is needed.
+"""
+def get_numpy():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+"""
+    Returns the parser for the grammar. Building the LALR tables is much
+    slower than reading them back, so Lark caches them in a file of the
+    temporary directory, keyed by a hash of the grammar, the options and
+    the Lark version. Within a process the parser is built only once. The
+    parser keeps the positions of the statements, used for profiling.
+"""
+def get_parser():
+    global _parser
+    if _parser is None:
+        _parser = Lark(grammar, parser='lalr', propagate_positions=True, cache=True)
+    return _parser
 
 #==============================================================================
 #=============================== Traversal Class ==============================
@@ -955,54 +3142,71 @@ formula = QBF()
     A set of functions triggered from the grammar that handle tokens read
     in the input file.
 
-    It generates a QBF object that is updated with the information gathered
-    from the parsed definition.
+    It generates a plan: the list of the calls, as (method name, arguments,
+    position) triples, that build a QBF object with the information gathered
+    from the parsed definition. The position is the (line, column, start,
+    end) of the statement in the source, or None when the parser does not
+    propagate positions.
 
 """
 @v_args(inline=True)
 class TraverseTree(Transformer):
 
-    """ Creates an empty QBF object that will be updated as parsing proceeds """
-    def __init__(self):
-        if formula:
-            self.formula = formula
-        else:
-            self.formula = QBF()
+    """ Creates an empty plan that will be extended as the tree is traversed """
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.plan = []
+
+    """ Adds a call to the plan, with the position of its statement """
+    def add_step(self, method, args, meta=None):
+        position = None
+        if meta is not None and not meta.empty:
+            position = (meta.line, meta.column, meta.start_pos, meta.end_pos)
+        self.plan.append((method, args, position))
     
     """ Handles a value assignment such as 'value: k = 10;' """
     def handle_value(self, name, expr):
-        if verbose:
+        if self.verbose:
             print("VALUE: Handling parameter {} with value {}.".format(name, expr))
         
-        self.formula.add_value(str(name), str(expr))
+        self.add_step("add_value", (str(name), str(expr)))
+
+    """ Handles a value read from a file such as 'value: edges from "graph.txt";' """
+    def handle_data(self, name, file_name, form=None):
+        if self.verbose:
+            print("VALUE: Handling parameter {} from file {}.".format(name, file_name))
+
+        self.add_step("add_value", (str(name), DataFile(str(file_name)[1:-1], form and str(form))))
 
     """ Sets the name of the formula family """
     def set_name(self, name):
-        if verbose:
+        if self.verbose:
             print("NAME: setting name \"{}\".".format(name))
         
-        self.formula.set_name(str(name))
+        self.add_step("set_name", (str(name),))
     
     """ Sets the format of the formula family """
     def set_format(self, f):
-        if verbose:
+        if self.verbose:
             print("FORMAT: setting format \'{}\'.".format(f))
         
-        self.formula.set_format(str(f))
+        self.add_step("set_format", (str(f),))
     
     """ Handles a parameter declaration """    
-    def add_parameter(self, p, t, *c):
+    @v_args(meta=True, inline=True)
+    def add_parameter(self, meta, p, t, *c):
         constr = []
         for elem in c:
             constr.append(str(elem))
         
-        if verbose:
+        if self.verbose:
             print("PARAMETER: adding parameter {} of type {} with constraints {}".format(p, t, constr))
         
-        self.formula.add_parameter(str(p), str(t), constr)
+        self.add_step("add_parameter", (str(p), str(t), constr), meta)
         
     """ Hanldes a variable declaration """    
-    def add_variable(self, varName, indices=[], *indexRanges):
+    @v_args(meta=True, inline=True)
+    def add_variable(self, meta, varName, indices=[], *indexRanges):
         varName = str(varName)
         varIndices = []
         if indices:
@@ -1025,13 +3229,14 @@ class TraverseTree(Transformer):
                 for ix in theIndices:
                     completeRanges.append([ix, (lim1, lim2)])
         
-        if verbose:
+        if self.verbose:
             print("VARIABLE: adding variable {} with indices {} and ranges {}".format(varName, varIndices, completeRanges))
         
-        self.formula.add_variables(varName, varIndices, completeRanges)
+        self.add_step("add_variables", (varName, varIndices, completeRanges), meta)
     
     """ Hanldes block definitions """    
-    def add_blocks(self, *everything):
+    @v_args(meta=True, inline=True)
+    def add_blocks(self, meta, *everything):
         grouping = None
         definitions = []
         conditions = []
@@ -1056,11 +3261,13 @@ class TraverseTree(Transformer):
             conds_to_send = conds_to_send + list(chain(self.handle_condition(c)))
         grouping_to_send = self.handle_grouping(grouping)
 
-        self.formula.add_blocks(defs_to_send, conds_to_send, grouping_to_send)
+        self.add_step("add_blocks", (defs_to_send, conds_to_send, grouping_to_send), meta)
     
     """ Hanldes attribute declarations """   
-    def add_attributes(self, *contents):
-        att = str(contents[len(contents)-1])
+    @v_args(meta=True, inline=True)
+    def add_attributes(self, meta, *contents):
+        att = contents[len(contents)-1]
+        att = att if isinstance(att, tuple) else str(att)
         contents = contents[:len(contents)-1]
         name_indices_pairs = []
         current_block = [[], []]
@@ -1078,19 +3285,24 @@ class TraverseTree(Transformer):
             name_indices_pairs.append(current_block)
         
         for block in name_indices_pairs:
-            if verbose:
+            if self.verbose:
                 print("ATTRIBUTE: adding attribute {} to block {} with indices {}".format(att, block[0], block[1]))
 
-            self.formula.add_attribute(block[0], block[1], att)
+            self.add_step("add_attribute", (block[0], block[1], att), meta)
 
     """ Hanldes attributes for groupings """   
-    def add_attribute_to_grouping(self, grp, att):
+    @v_args(meta=True, inline=True)
+    def add_attribute_to_grouping(self, meta, grp, att):
         grp_name = str(grp)
-        att = str(att)
-        if verbose:
+        att = att if isinstance(att, tuple) else str(att)
+        if self.verbose:
             print("ATTRIBUTE: adding attribute {} to all blocks in grouping {}".format(att, grp_name))
-        self.formula.add_attributes_grp(grp, att)
+        self.add_step("add_attributes_grp", (grp_name, att), meta)
     
+    """ Handles cardinality constraints, returned as their kind and the expression of their bound """
+    def cardinality(self, kind, k):
+        return (CARDINALITY_KINDS[str(kind)], str(k))
+
     """ Hanldes conditions in block definitions """   
     def handle_condition(self, condition):
         condition = condition.children[0]
@@ -1137,7 +3349,7 @@ class TraverseTree(Transformer):
                 brick_to_send = ((sign, name), indices)
             bricks_to_send.append(brick_to_send)
         
-        if verbose:
+        if self.verbose:
             print("BLOCK: adding block {} with body {}.".format(block_name, bricks_to_send))
 
         return [block_name, bricks_to_send]
@@ -1145,78 +3357,516 @@ class TraverseTree(Transformer):
     """ Hanldes groupings """   
     def handle_grouping(self, grp):
         if grp:
-            if verbose:
+            if self.verbose:
                 print("GROUPING: adding grouping {}.".format(str(grp.children[0])))
             return str(grp.children[0])
         else:
             return grp
 
     """ Sets the output block """   
-    def add_final_block(self, name, indices=[]):
+    @v_args(meta=True, inline=True)
+    def add_final_block(self, meta, name, indices=[]):
         if indices:
             indices = [str(ix) for ix in indices.children]
 
-        if verbose:
+        if self.verbose:
             print("FINAL BLOCK: block {} with indices {} saves as output block".format(name, indices))
         
-        self.formula.save_final_block(name, indices)
+        self.add_step("save_final_block", (str(name), indices), meta)
         
             
-    """ Returns the built QBF object """
+    """ Returns the plan built from the parsed file """
     def return_formula(self, *r):
-        return self.formula
+        return self.plan
 
 #==============================================================================
-#=============================== Script functions =============================
+#=============================== Formula families =============================
 #==============================================================================
+"""
+    A formula family compiled from its definition. The definition is parsed
+    only once into a plan of calls, which is then replayed on a new QBF
+    object for every instance. Instances share no state, so a family can be
+    instantiated any number of times, also from several threads at once.
+"""
+class FormulaFamily:
 
-def generate(input_file, values_file, internal, output_formats):
-    # Generate the parsing function from the grammar and the traversal class
-    parser_obj = Lark(grammar, parser='lalr', transformer=TraverseTree())
-    parse = parser_obj.parse
+    def __init__(self, definition, parser=None, verbose=False):
+        if not parser:
+            parser = get_parser()
+        self.definition = definition
+        self.plan = TraverseTree(verbose).transform(parse(parser, definition, "definition"))
 
-    # Read values file
-    try:
-        f = open(values_file, "r")
-    except:
-        print("FILE ERROR: the values file {} does not exist or could not be opened.".format(values_file))
-        exit()
-    v = f.read()
-    f.close()
+    """
+        Returns a short description of the statement at the given position
+        of the definition: its line and the beginning of its text.
+    """
+    def statement_label(self, position):
+        line, column, start, end = position
+        text = " ".join(self.definition[start:end].split())
+        if len(text) > 60:
+            text = text[:57] + "..."
+        return "line {}: {}".format(line, text)
+
+    """
+        Returns a new QBF object with the instance of the family for the given
+        values. These are either a dictionary with the value of each
+        parameter, or a list of (name, expression) pairs as read from a
+        values file, which are evaluated in order. The values in overrides
+        are set first and take precedence over the ones with the same name
+        in values, whose expressions may refer to them. If a profiler is
+        given, the instance is instrumented to report to it. If compact is
+        set, its blocks are kept in a CompactBlockStore. Its cardinality
+        constraints are expanded with the given encoding, so instances of
+        the same family may use different ones.
+    """
+    def instantiate(self, values, overrides={}, profiler=None, compact=False, cardinality="sequential"):
+        formula = QBF(compact, cardinality)
+        if profiler:
+            profiler.instrument(formula)
+        for name in overrides:
+            formula.set_value(name, overrides[name])
+        if isinstance(values, dict):
+            for name in values:
+                if name not in overrides:
+                    formula.set_value(name, values[name])
+        else:
+            for name, expression in values:
+                if name not in overrides:
+                    formula.add_value(name, expression)
+
+        for method, args, position in self.plan:
+            if profiler and position:
+                with profiler.statement(self.statement_label(position), method, formula):
+                    getattr(formula, method)(*args)
+            else:
+                getattr(formula, method)(*args)
+        return formula
+
+#==============================================================================
+#================================== Profiling =================================
+#==============================================================================
+
+# Number of statements of the definition listed in the profiling table
+STATEMENTS_IN_REPORT = 20
+
+# Phase in which each method of a QBF object is run when profiling
+PROFILED_PHASES = {
+    "add_value": "values evaluation",
+    "set_value": "values evaluation",
+    "add_parameter": "parameter checks",
+    "add_variables": "variable declaration",
+    "add_blocks": "block expansion",
+    "add_attribute": "attribute assignment",
+    "add_attributes_grp": "attribute assignment",
+}
+
+"""
+    A dictionary that counts the lookups made on it, used to replace the
+    dictionaries of a QBF object when profiling.
+"""
+class CountingDict(dict):
+
+    def __init__(self, counters, *args):
+        super().__init__(*args)
+        self.counters = counters
+
+    def __getitem__(self, key):
+        self.counters["dictionary lookups"] += 1
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self.counters["dictionary lookups"] += 1
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        self.counters["dictionary lookups"] += 1
+        return super().get(key, default)
+
+"""
+    Collects the wall time, CPU time and peak memory of each phase of the
+    generation, and counts the calls to the hot operations of QBF objects.
+    Expressions evaluated one tuple at a time are counted as evaluate calls,
+    wherever they are evaluated, and those evaluated with NumPy as one
+    vectorized evaluation per tuple they are evaluated for.
+    Memory is traced with tracemalloc, which makes the whole run slower, so
+    times are only meaningful relative to each other.
+
+    The cost of generating an instance is also attributed to the statements
+    of the definition: time, tuples enumerated, blocks created and bricks
+    resolved by each of them. Phases and statements are recorded as events
+    that can be exported as a Chrome trace (chrome://tracing, Perfetto).
+"""
+class Profiler:
+
+    def __init__(self):
+        self.phases = {}
+        self.statements = {}
+        self.events = []
+        self.counters = {"evaluate calls": 0, "vectorized evaluations": 0, "iterate tuples": 0,
+                         "bricks resolved": 0, "normalize_name calls": 0, "dictionary lookups": 0}
+        self.current = None
+        self.start = perf_counter()
+        tracemalloc.start()
+
+    def add_event(self, name, category, start, duration, args={}):
+        self.events.append({"name": name, "cat": category, "ph": "X", "pid": 1, "tid": 1,
+                            "ts": (start - self.start) * 1e6, "dur": duration * 1e6, "args": args})
+
+    """
+        Context manager measuring a phase. Phases with the same name are
+        accumulated, and a phase started within another one is accounted
+        only in the outer one.
+    """
+    @contextmanager
+    def phase(self, name):
+        if self.current is not None:
+            yield
+            return
+        self.current = name
+        tracemalloc.reset_peak()
+        wall = perf_counter()
+        cpu = process_time()
+        try:
+            yield
+        finally:
+            wall = perf_counter() - wall
+            cpu = process_time() - cpu
+            peak = tracemalloc.get_traced_memory()[1]
+            self.current = None
+            stats = self.phases.setdefault(name, {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak_memory": 0})
+            stats["calls"] += 1
+            stats["wall"] += wall
+            stats["cpu"] += cpu
+            stats["peak_memory"] = max(stats["peak_memory"], peak)
+            self.add_event(name, "phase", perf_counter() - wall, wall)
+
+    """
+        Context manager measuring the run of a statement of the definition
+        on the given QBF object.
+    """
+    @contextmanager
+    def statement(self, label, method, formula):
+        counters = self.counters
+        tuples = counters["iterate tuples"]
+        bricks = counters["bricks resolved"]
+        blocks = len(formula.block_contents)
+        wall = perf_counter()
+        try:
+            yield
+        finally:
+            end = perf_counter()
+            cost = {"tuples": counters["iterate tuples"] - tuples,
+                    "blocks": len(formula.block_contents) - blocks,
+                    "bricks": counters["bricks resolved"] - bricks}
+            stats = self.statements.setdefault(label, {"method": method, "calls": 0, "wall": 0.0,
+                                                       "tuples": 0, "blocks": 0, "bricks": 0})
+            stats["calls"] += 1
+            stats["wall"] += end - wall
+            for what in cost:
+                stats[what] += cost[what]
+            self.add_event(label, method, wall, end - wall, cost)
+
+    def timed(self, name, function):
+        def timed_function(*args, **kwargs):
+            with self.phase(name):
+                return function(*args, **kwargs)
+        return timed_function
+
+    def counted(self, name, function):
+        counters = self.counters
+        def counted_function(*args, **kwargs):
+            counters[name] += 1
+            return function(*args, **kwargs)
+        return counted_function
+
+    def counted_bricks(self, function):
+        counters = self.counters
+        def counted_function(new_block, bricks, values):
+            counters["bricks resolved"] += len(bricks)
+            return function(new_block, bricks, values)
+        return counted_function
+
+    def counted_vectorized(self, function):
+        counters = self.counters
+        def counted_function(expr, columns, size, boolean):
+            result = function(expr, columns, size, boolean)
+            # expressions that cannot be vectorized are evaluated one by one
+            if result is not None:
+                counters["vectorized evaluations"] += size
+            return result
+        return counted_function
+
+    def counted_generator(self, name, function):
+        counters = self.counters
+        def counted_function(*args, **kwargs):
+            for item in function(*args, **kwargs):
+                counters[name] += 1
+                yield item
+        return counted_function
+
+    """
+        Replaces the methods and dictionaries of a new QBF object by
+        versions reporting to the profiler.
+    """
+    def instrument(self, formula):
+        for method in PROFILED_PHASES:
+            setattr(formula, method, self.timed(PROFILED_PHASES[method], getattr(formula, method)))
+        formula.evaluate = self.counted("evaluate calls", formula.evaluate)
+        formula.try_evaluate = self.counted("evaluate calls", formula.try_evaluate)
+        # the row of the matrix of an adjacency pattern is evaluated once per call
+        formula.adjacent_values = self.counted("evaluate calls", formula.adjacent_values)
+        formula.evaluate_vectorized = self.counted_vectorized(formula.evaluate_vectorized)
+        formula.normalize_name = self.counted("normalize_name calls", formula.normalize_name)
+        formula.iterate = self.counted_generator("iterate tuples", formula.iterate)
+        formula.add_bricks = self.counted_bricks(formula.add_bricks)
+        formula.variables.explicit = CountingDict(self.counters, formula.variables.explicit)
+        if isinstance(formula.blocks, dict):
+            formula.blocks = CountingDict(self.counters, formula.blocks)
+        if isinstance(formula.block_contents, dict):
+            formula.block_contents = CountingDict(self.counters, formula.block_contents)
+
+    def report(self):
+        return {"phases": self.phases, "statements": self.statements, "counters": self.counters}
+
+    def print_report(self):
+        print("")
+        print("{:<28} {:>7} {:>11} {:>11} {:>14}".format("Phase", "Calls", "Wall (s)", "CPU (s)", "Peak mem (KiB)"))
+        for name, stats in self.phases.items():
+            print("{:<28} {:>7} {:>11.4f} {:>11.4f} {:>14}".format(
+                name, stats["calls"], stats["wall"], stats["cpu"], stats["peak_memory"] // 1024))
+        print("")
+        for name, count in self.counters.items():
+            print("{:<28} {:>12}".format(name, count))
+        print("")
+        if self.statements:
+            total = sum(stats["wall"] for stats in self.statements.values()) or 1
+            print("{:>11} {:>6} {:>10} {:>9} {:>9}  {}".format("Wall (s)", "%", "Tuples", "Blocks", "Bricks", "Statement"))
+            ranking = sorted(self.statements.items(), key=lambda item: -item[1]["wall"])
+            for label, stats in ranking[:STATEMENTS_IN_REPORT]:
+                print("{:>11.4f} {:>6.1f} {:>10} {:>9} {:>9}  {}".format(
+                    stats["wall"], 100 * stats["wall"] / total, stats["tuples"],
+                    stats["blocks"], stats["bricks"], label))
+            print("")
+
+    def write_report(self, file_name):
+        f = open(file_name, "w")
+        dump(self.report(), f, indent=2)
+        f.close()
+
+    def write_trace(self, file_name):
+        f = open(file_name, "w")
+        dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        f.close()
+
+#==============================================================================
+#=============================== Script functions =============================
+#==============================================================================
 
-    # Parse values:
+"""
+    Parses a text with the given parser, reporting syntax errors on the
+    given kind of file.
+"""
+def parse(parser, text, what):
     try:
-        formula = parse(v)
+        return parser.parse(text)
     except Exception as e:
         s = str(e)
         # uncomment the following line to see full parsing error messages
         #print(s)
         start = s.find("at line")
         finish = s.find("Expected one")
-        print("PARSING ERROR: invalid syntax when parsing the values {}".format(s[start:finish-1]))
+        print("PARSING ERROR: invalid syntax when parsing the {} {}".format(what, s[start:finish-1]))
         exit()
 
+# A value statement and the whitespace and comments before it, as read by
+# the grammar for the names starting with a-z, which take all the characters
+# they can, like the longest match of the lexer
+VALUE_STATEMENT = re.compile(r'''(?:\s|/\*(?:\*[^/]|[^*])*\*/)*value:\s*(?=([a-z][^,:;(){}\s]*))\1\s*
+    (?:=\s*(?:([0-9]+)|`([^`]+)`)|from\s*("[^"]*")(?:\s*as\s*(npy|csv|json|undirected-edges|edges))?)\s*;''', re.X)
+END_OF_VALUES = re.compile(r"(?:\s|/\*(?:\*[^/]|[^*])*\*/)*")
+
+"""
+    Reads a values file made only of value statements without going through
+    the parser, which is much slower on long expressions. Returns the same
+    (name, expression) pairs as the parser, or None if the file has anything
+    else, so that it is left to the parser.
+"""
+def scan_values(values_str, verbose=False):
+    traverser = TraverseTree(verbose)
+    pos = 0
+    while True:
+        match = VALUE_STATEMENT.match(values_str, pos)
+        if match is None:
+            break
+        name, number, expr, file_name, form = match.groups()
+        if file_name is None:
+            traverser.handle_value(name, number if number is not None else expr)
+        else:
+            traverser.handle_data(name, file_name, form)
+        pos = match.end()
+    if END_OF_VALUES.match(values_str, pos).end() != len(values_str):
+        return None
+    return [args for (method, args, position) in traverser.plan]
 
-    # Read input definition file
+"""
+    Parses the contents of a values file into a list of (name, expression)
+    pairs, in the order in which they have to be evaluated. Values read from
+    files have a DataFile instead of an expression, whose file name is taken
+    relative to the given directory, the one of the values file.
+"""
+def read_values(values_str, parser, verbose=False, directory=""):
+    values = scan_values(values_str, verbose)
+    if values is None:
+        plan = TraverseTree(verbose).transform(parse(parser, values_str, "values"))
+        values = [args for (method, args, position) in plan if method == "add_value"]
+    for name, expression in values:
+        if isinstance(expression, DataFile):
+            expression.file_name = path.join(directory, expression.file_name)
+    return values
+
+def read_file(file_name, what):
     try:
-        f = open(input_file, "r")
+        f = open(file_name, "r")
     except:
-        print("FILE ERROR: the input file {} does not exist or could not be opened.".format(input_file))
+        print("FILE ERROR: the {} file {} does not exist or could not be opened.".format(what, file_name))
         exit()
-    s = f.read()
+    contents = f.read()
     f.close()
+    return contents
+
+"""
+    Reads the value sets of a sweep. The specification is either a JSONL
+    file with one object of values per line, or a list of parameter ranges
+    whose cartesian product is taken, e.g. ['n=1..500', 'k=2..6']. Each
+    range is either lo..hi (both included) or a comma-separated list of
+    values.
+"""
+def read_sweep(sweep_specs):
+    if len(sweep_specs) == 1 and sweep_specs[0].endswith(".jsonl"):
+        points = []
+        lines = read_file(sweep_specs[0], "sweep").splitlines()
+        for i, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                point = loads(line)
+            except ValueError:
+                point = None
+            if not isinstance(point, dict):
+                print("SWEEP ERROR: line {} of {} is not a JSON object of values.".format(i + 1, sweep_specs[0]))
+                exit()
+            points.append(point)
+        return points
+
+    names = []
+    ranges = []
+    for spec in sweep_specs:
+        name, _, values = spec.partition("=")
+        name = name.strip()
+        try:
+            if ".." in values:
+                lo, hi = values.split("..")
+                values = list(range(int(lo), int(hi) + 1))
+            else:
+                values = [literal_eval(v.strip()) for v in values.split(",")]
+        except (ValueError, SyntaxError):
+            values = []
+        if not name.isidentifier() or not values:
+            print("SWEEP ERROR: invalid sweep range {}, expected name=lo..hi or name=v1,v2,...".format(spec))
+            exit()
+        names.append(name)
+        ranges.append(values)
+    return [dict(zip(names, point)) for point in product(*ranges)]
 
-    # Parse the definition and get a QBF object with the internal repr.
+"""
+    Instantiates the name of an output file for the given values, replacing
+    every {parameter} in the template by its value.
+"""
+def output_file_name(template, point):
+    if template == "-stdIO":
+        return template
     try:
-        formula = parse(s)
-    except Exception as e:
-        s = str(e)
-        # uncomment the following line to see full parsing error messages
-        #print(s)
-        start = s.find("at line")
-        finish = s.find("Expected one")
-        print("PARSING ERROR: invalid syntax when parsing the definition {}".format(s[start:finish-1]))
+        return template.format(**point)
+    except (KeyError, IndexError, ValueError):
+        print("SWEEP ERROR: the output file name {} refers to values not in the sweep.".format(template))
+        exit()
+
+"""
+    Generates the instances of the family in input_file for the values in
+    values_file, or for each point of the sweep, and writes them in the
+    given formats. The options are those of the command line: compact and
+    cardinality are as in FormulaFamily.instantiate, and the others as in
+    output_formula.
+"""
+def generate(input_file, values_file, internal, output_formats, sweep_specs=[], profiler=None,
+             compact=False, cardinality="sequential", polarity=False, simplify=False, hash_gates=False,
+             prune=False):
+    phase = profiler.phase if profiler else lambda name: nullcontext()
+
+    # Generate the parsing function from the grammar
+    with phase("Lark construction"):
+        parser_obj = get_parser()
+
+    # Read and parse the values
+    with phase("values parse"):
+        values = read_values(read_file(values_file, "values"), parser_obj, verbose, path.dirname(values_file))
+
+    # Parse the definition once into a formula family
+    with phase("definition parse"):
+        family = FormulaFamily(read_file(input_file, "input"), parser_obj, verbose)
+
+    if not sweep_specs:
+        formula = family.instantiate(values, profiler=profiler, compact=compact, cardinality=cardinality)
+        output_formula(formula, internal, output_formats, profiler, polarity=polarity, simplify=simplify,
+                       hash_gates=hash_gates, prune=prune)
+        return
+
+    points = read_sweep(sweep_specs)
+    for output in output_formats:
+        names = set(output_file_name(output[1], point) for point in points)
+        if output[1] != "-stdIO" and len(names) < len(points):
+            print("SWEEP ERROR: the output file name {} is the same for several instances, use {{parameter}} fields to tell them apart.".format(output[1]))
+            exit()
+
+    start = time()
+    for point in points:
+        formula = family.instantiate(values, point, profiler, compact, cardinality)
+        outputs = [[form, output_file_name(outp, point)] for form, outp in output_formats]
+        output_formula(formula, internal, outputs, profiler, polarity=polarity, simplify=simplify,
+                       hash_gates=hash_gates, prune=prune)
+        if verbose:
+            print("Generated instance {}".format(", ".join("{} = {}".format(name, point[name]) for name in point)))
+    if verbose:
+        print("Generated {} instances in {:.2f} seconds".format(len(points), time() - start))
+
+"""
+    Writes an instance of a formula family in each of the given formats,
+    simplifying it, merging its equal gates and pruning it first if
+    -simplify, -hash-gates and -prune were given. With simplify set, trivial
+    gates and constants are folded. With hash_gates set, gates equal to an
+    earlier one are merged into it. With prune set, what does not reach the
+    output is removed and the rest is renumbered densely. With polarity set,
+    circuits are written in QDIMACS with the Plaisted-Greenbaum encoding.
+"""
+def output_formula(formula, internal, output_formats, profiler=None, polarity=False, simplify=False,
+                   hash_gates=False, prune=False):
+    phase = profiler.phase if profiler else lambda name: nullcontext()
+
+    if (simplify or hash_gates or prune) and formula.get_format() == Format.circuit_NON_PRENEX:
+        print("FORMAT ERROR: the given formula is in non-prenex format; -simplify, -hash-gates and -prune are only available for prenex formulae.")
         exit()
+    if formula.cardinality_blocks:
+        with phase("cardinality expansion"):
+            formula.expand_cardinality_gates()
+    if simplify:
+        with phase("simplification"):
+            formula.simplify()
+    if hash_gates:
+        with phase("gate hashing"):
+            formula.hash_gates()
+    if prune:
+        with phase("pruning"):
+            formula.prune_and_renumber()
 
     # Output the formula
     if internal:
@@ -1225,36 +3875,81 @@ def generate(input_file, values_file, internal, output_formats):
     for output in output_formats: # user-given formats
         form = output[0]
         outp = output[1]
-        formula_str = ""
-        if output[0] == "-QDIMACS":
-            formula_str = formula.get_QDIMACS_string()
-        elif output[0] == "-QCIR":
-            formula_str = formula.get_QCIR_string()
-        elif output[0] == "-non-prenex-QCIR":
-            formula_str = formula.get_non_prenex_QCIR_string()
-
-        if outp == "-stdIO":
-            print("")
-            print(formula_str)
-            print("")
-        else:
-            f = open(outp, "w")
-            f.write(formula_str)
+        with phase("output " + form[1:]):
+            lines = []
+            if output[0] == "-QDIMACS":
+                lines = formula.iter_QDIMACS_lines(polarity)
+            elif output[0] == "-QCIR":
+                lines = formula.iter_QCIR_lines()
+            elif output[0] == "-non-prenex-QCIR":
+                lines = [formula.get_non_prenex_QCIR_string()]
+
+            write_lines(lines, outp)
+
+"""
+    Writes the lines of an output either on the standard output or on the
+    given file, through a buffered sink, as they are produced.
+"""
+def write_lines(lines, outp):
+    if outp == "-stdIO":
+        stdout.write("\n")
+        stdout.writelines(lines)
+        stdout.write("\n\n")
+    else:
+        f = open(outp, "w", buffering=OUTPUT_BUFFER_SIZE)
+        try:
+            f.writelines(lines)
+        except BaseException:
+            # do not leave a truncated instance behind after an error
             f.close()
+            remove(outp)
+            raise
+        f.close()
     
 def read_arguments():
     global verbose
     input_file = argv[1]
     values_file = argv[2]
     internal = False
+    # keyword arguments of generate
+    options = {}
     outputs = []
+    sweep_specs = []
+    trace = None
     current_format = [[], []]
-    for arg in argv[3::]:
+    args = iter(argv[3::])
+    for arg in args:
         if arg == "-internal":
             internal = True
         elif arg == "-verbose":
             verbose = True
-        elif arg in ["-QDIMACS", "-QCIR", "-non-prenex-QCIR"]:
+        elif arg == "-compact":
+            options["compact"] = True
+        elif arg == "-cardinality":
+            options["cardinality"] = next(args, None)
+            if options["cardinality"] not in CARDINALITY_ENCODINGS:
+                print("Invalid arguments: the encoding after -cardinality should be one of {}".format(", ".join(CARDINALITY_ENCODINGS)))
+                exit()
+        elif arg == "-polarity":
+            options["polarity"] = True
+        elif arg == "-simplify":
+            options["simplify"] = True
+        elif arg == "-hash-gates":
+            options["hash_gates"] = True
+        elif arg == "-prune":
+            options["prune"] = True
+        elif arg == "-sweep":
+            spec = next(args, None)
+            if spec is None:
+                print("Invalid arguments: missing sweep after -sweep")
+                exit()
+            sweep_specs.append(spec)
+        elif arg == "-trace":
+            trace = next(args, None)
+            if trace is None:
+                print("Invalid arguments: missing file after -trace")
+                exit()
+        elif arg in ["-QDIMACS", "-QCIR", "-non-prenex-QCIR", "-profile"]:
             if current_format[0]:
                 if not current_format[1]:
                     current_format[1] = "-stdIO"
@@ -1274,17 +3969,24 @@ def read_arguments():
             current_format[1] = "-stdIO"
         outputs.append(current_format)   
 
+    # the profiling report is given like an output, with an optional file
+    profile = None
+    for output in outputs:
+        if output[0] == "-profile":
+            profile = output[1]
+    outputs = [output for output in outputs if output[0] != "-profile"]
+
     if len(outputs) == 0 and not internal:
         print("Invalid arguments")
         exit()
 
-    return input_file, values_file, internal, outputs
+    return input_file, values_file, internal, outputs, sweep_specs, profile, trace, options
 
 def print_help():
     print("")
     print("Input should be of the form:")
     print("")
-    print("python main.py definition_file values_file [-internal] [-QDIMACS {file.qdimacs | [-stdIO]}] [-QCIR {file.QCIR | [-stdIO]}] [-non-prenex-QCIR {file.QCIR | [-stdIO]}]")
+    print("python main.py definition_file values_file [-internal] [-compact] [-cardinality {sequential | commander | ladder | totalizer}] [-polarity] [-simplify] [-hash-gates] [-prune] [-sweep {name=lo..hi | name=v1,v2,... | values.jsonl}]... [-QDIMACS {file.qdimacs | [-stdIO]}] [-QCIR {file.QCIR | [-stdIO]}] [-non-prenex-QCIR {file.QCIR | [-stdIO]}] [-profile {file.json | [-stdIO]}] [-trace file.json]")
     print("")
 
 def run_generator():
@@ -1293,15 +3995,22 @@ def run_generator():
     if len(argv) <= 1:
         print("Missing arguments!")
         return
-    elif len(argv) > 11:
-        print("Too many arguments!")
-        return
     elif len(argv) == 2 and argv[1] in ["-help", "--help", "-h", "--h"]:
         print_help()
         return
 
     # Process arguments:
-    input_file, values_file, internal, output_formats  = read_arguments()
-    generate(input_file, values_file,  internal, output_formats)
+    input_file, values_file, internal, output_formats, sweep_specs, profile, trace, options = read_arguments()
+    profiler = Profiler() if profile or trace else None
+    generate(input_file, values_file, internal, output_formats, sweep_specs, profiler, **options)
+
+    if profile == "-stdIO":
+        profiler.print_report()
+    elif profile:
+        profiler.write_report(profile)
+    if trace:
+        profiler.write_trace(trace)
+
 
-run_generator()
\ No newline at end of file
+if __name__ == "__main__":
+    run_generator()
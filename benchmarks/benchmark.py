@@ -0,0 +1,307 @@
+"""
+    End-to-end scaling benchmark for QBDef.
+
+    Runs QBDef.py on the example families in examples/ for increasing values
+    of their parameters and every output format they support. Each run is a
+    separate process, so that the measures include the whole cost of a
+    command-line invocation. For each run it records the wall time, the peak
+    resident memory, the size of the output (variables, gates and clauses)
+    and the throughput in variables, gates and clauses per second.
+
+    Results are written as JSON. Given a previous results file with
+    --compare, it prints the speed-up or slow-down of every run with respect
+    to it, and exits with a non-zero status if any run got slower than the
+    allowed threshold.
+
+    Usage:
+
+        python3 benchmarks/benchmark.py [--quick] [--families F ...]
+                                        [--formats F ...] [--repeat N]
+                                        [--output results.json]
+                                        [--compare baseline.json]
+                                        [--threshold 1.10]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, strftime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QBDEF = os.path.join(ROOT, "QBDef.py")
+EXAMPLES = os.path.join(ROOT, "examples")
+
+FORMATS = ["-QCIR", "-QDIMACS", "-non-prenex-QCIR"]
+
+#==============================================================================
+#================================= Families ===================================
+#==============================================================================
+
+"""
+    Returns the adjacency matrix of a random graph on n vertices, always
+    containing the cycle 1, ..., n so that it is connected. The seed is
+    fixed, so that every run of the suite generates the same instances.
+"""
+def random_graph(n, p, directed=False):
+    rand = random.Random(n)
+    edges = [[0] * n for _ in range(n)]
+    for i in range(n):
+        edges[i][(i + 1) % n] = 1
+        if not directed:
+            edges[(i + 1) % n][i] = 1
+    for i in range(n):
+        for j in range(i + 1, n):
+            if rand.random() < p:
+                edges[i][j] = 1
+                if not directed:
+                    edges[j][i] = 1
+    if n == 1:
+        edges[0][0] = 0
+    return edges
+
+def chromatic_values(n):
+    return {"n": n, "edges": random_graph(n, 0.3), "k": 3}
+
+def geography_values(n):
+    return {"n": n, "edges": random_graph(n, 0.2, directed=True), "k": 4, "s": 1}
+
+"""
+    The benchmarked families: definition file, formats it can be output in,
+    function giving the values for each size, and the sizes of the full and
+    the quick suite.
+"""
+FAMILIES = {
+    "ChenType1": {
+        "definition": "ChenType1/Chen1_def.txt",
+        "formats": ["-QCIR", "-QDIMACS"],
+        "values": lambda n: {"n": n},
+        "sizes": [10, 100, 1000, 5000],
+        "quick": [10, 100],
+    },
+    "ChenType2": {
+        "definition": "ChenType2/Chen2_def.txt",
+        "formats": ["-QCIR", "-QDIMACS"],
+        "values": lambda n: {"n": n},
+        "sizes": [10, 100, 1000, 5000],
+        "quick": [10, 100],
+    },
+    "Chromatic": {
+        "definition": "Chromatic/chromatic_def.txt",
+        "formats": ["-QCIR", "-QDIMACS"],
+        "values": chromatic_values,
+        "sizes": [10, 20, 40, 80],
+        "quick": [10, 20],
+    },
+    "Geography": {
+        "definition": "Geography/geography_def.txt",
+        "formats": ["-QCIR", "-QDIMACS"],
+        "values": geography_values,
+        "sizes": [10, 20, 40],
+        "quick": [10],
+    },
+    "Janota": {
+        "definition": "Janota/Janota_def.txt",
+        "formats": ["-QCIR", "-QDIMACS"],
+        "values": lambda n: {"n": n},
+        "sizes": [5, 10, 20, 40],
+        "quick": [5, 10],
+    },
+    "KBKF": {
+        "definition": "KBKF/KBKF_def.txt",
+        "formats": ["-QCIR", "-QDIMACS"],
+        "values": lambda t: {"t": t},
+        "sizes": [10, 100, 300, 1000],
+        "quick": [10, 100],
+    },
+    "QParity": {
+        "definition": "QParity/QParity_definition.txt",
+        "formats": ["-QCIR", "-QDIMACS"],
+        "values": lambda n: {"n": n},
+        "sizes": [10, 1000, 10000, 100000],
+        "quick": [10, 1000],
+    },
+    "SimpleExample": {
+        "definition": "SimpleExample/SimpleExample_def.txt",
+        "formats": ["-QCIR", "-QDIMACS"],
+        "values": lambda n: {"n": n},
+        "sizes": [10, 1000, 10000, 100000],
+        "quick": [10, 1000],
+    },
+    "NonPrenexExample": {
+        "definition": "NonPrenexExample/NonPrenexExample.txt",
+        "formats": ["-non-prenex-QCIR"],
+        "values": lambda n: {},
+        "sizes": [1],
+        "quick": [1],
+    },
+}
+
+#==============================================================================
+#================================ Measuring ===================================
+#==============================================================================
+
+"""
+    Writes the values of an instance in the syntax of QBDef's values files.
+"""
+def values_file_contents(values):
+    return "".join("value: {} = `{}`;\n".format(name, json.dumps(value))
+                   for name, value in values.items())
+
+"""
+    Counts the variables, gates and clauses of an output file.
+"""
+def count_output(output_file, form):
+    variables = gates = clauses = 0
+    with open(output_file) as f:
+        if form == "-QDIMACS":
+            for line in f:
+                if line.startswith("p cnf"):
+                    _, _, v, c = line.split()
+                    variables, clauses = int(v), int(c)
+                    break
+        else:
+            for line in f:
+                if line.startswith(("#", "output")):
+                    continue
+                if "=" in line:
+                    gates += 1
+                elif "(" in line:
+                    # quantifier line
+                    variables += line.count(",") + 1
+    return {"variables": variables, "gates": gates, "clauses": clauses}
+
+"""
+    Runs QBDef once as a child process, returning its wall time in seconds,
+    its peak resident memory in KiB, its exit status and its error output.
+"""
+def run_once(definition, values_file, form, output_file):
+    args = [sys.executable, QBDEF, definition, values_file, form, output_file]
+    start = perf_counter()
+    child = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = child.stdout.read()
+    _, status, usage = os.wait4(child.pid, 0)
+    wall = perf_counter() - start
+    child.returncode = os.waitstatus_to_exitcode(status)
+    child.stdout.close()
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return wall, peak, child.returncode, out.decode(errors="replace").strip()
+
+def run_case(family, size, form, repeat, workdir):
+    spec = FAMILIES[family]
+    definition = os.path.join(EXAMPLES, spec["definition"])
+    values_file = os.path.join(workdir, "values.txt")
+    output_file = os.path.join(workdir, "output")
+    with open(values_file, "w") as f:
+        f.write(values_file_contents(spec["values"](size)))
+
+    result = {"family": family, "size": size, "format": form}
+    walls = []
+    peaks = []
+    for _ in range(repeat):
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        wall, peak, code, out = run_once(definition, values_file, form, output_file)
+        # QBDef reports its errors on the standard output
+        if code != 0 or "ERROR" in out or not os.path.exists(output_file):
+            result["error"] = out.splitlines()[-1] if out else "exit status {}".format(code)
+            return result
+        walls.append(wall)
+        peaks.append(peak)
+
+    result["wall"] = min(walls)
+    result["walls"] = walls
+    result["peak_rss_kib"] = max(peaks)
+    result.update(count_output(output_file, form))
+    for what in ["variables", "gates", "clauses"]:
+        result[what + "_per_sec"] = result[what] / result["wall"]
+    return result
+
+#==============================================================================
+#================================= Reporting ==================================
+#==============================================================================
+
+def case_key(result):
+    return (result["family"], result["size"], result["format"])
+
+def print_result(result):
+    name = "{:<17} {:>7} {:<17}".format(result["family"], result["size"], result["format"])
+    if "error" in result:
+        print("{} ERROR {}".format(name, result["error"]))
+    else:
+        print("{} {:>9.3f}s {:>9} KiB {:>9} vars {:>9} gates {:>9} clauses".format(
+            name, result["wall"], result["peak_rss_kib"], result["variables"],
+            result["gates"], result["clauses"]))
+
+"""
+    Prints how the wall time of every run compares to the baseline, and
+    returns the runs whose time grew by more than the threshold ratio.
+"""
+def compare(results, baseline, threshold):
+    previous = {case_key(r): r for r in baseline["results"] if "error" not in r}
+    regressions = []
+    print("")
+    print("Comparison with the baseline of {}:".format(baseline.get("date", "unknown date")))
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None or "error" in result:
+            continue
+        ratio = result["wall"] / old["wall"]
+        name = "{:<17} {:>7} {:<17}".format(*case_key(result))
+        mark = ""
+        if ratio > threshold:
+            mark = "  SLOWER"
+            regressions.append(result)
+        print("{} {:>9.3f}s -> {:>9.3f}s  x{:.2f}{}".format(name, old["wall"], result["wall"], ratio, mark))
+    return regressions
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="End-to-end scaling benchmark for QBDef.")
+    arg_parser.add_argument("--families", nargs="+", choices=sorted(FAMILIES), default=sorted(FAMILIES))
+    # formats are given without their leading dash, which argparse would take as an option
+    arg_parser.add_argument("--formats", nargs="+", choices=[form[1:] for form in FORMATS],
+                            default=[form[1:] for form in FORMATS])
+    arg_parser.add_argument("--quick", action="store_true", help="only run the smallest sizes")
+    arg_parser.add_argument("--repeat", type=int, default=1, help="runs per case, the fastest one is kept")
+    arg_parser.add_argument("--output", help="file to write the JSON results to")
+    arg_parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    arg_parser.add_argument("--threshold", type=float, default=1.10,
+                            help="slow-down ratio over the baseline reported as a regression")
+    args = arg_parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for family in args.families:
+            spec = FAMILIES[family]
+            for size in spec["quick"] if args.quick else spec["sizes"]:
+                for form in spec["formats"]:
+                    if form[1:] not in args.formats:
+                        continue
+                    result = run_case(family, size, form, args.repeat, workdir)
+                    print_result(result)
+                    results.append(result)
+
+    report = {
+        "date": strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from QBDef import BlockTable
+
+
+def fill(keys, first_id=1):
+    table = BlockTable()
+    expected = {}
+    for bId, key in enumerate(keys, first_id):
+        table[key] = bId
+        expected[key] = bId
+    return table, expected
+
+
+def check(table, expected):
+    assert len(table) == len(expected)
+    assert list(table) == list(expected)
+    assert list(table.items()) == list(expected.items())
+    for key, bId in expected.items():
+        assert key in table
+        assert table[key] == bId
+        assert table.key_of(bId) == key
+
+
+def test_strided_keys():
+    for stride in [2, 3, 7]:
+        table, expected = fill([("C", i) for i in range(1, 2000, stride)])
+        check(table, expected)
+        assert ("C", 2) not in table
+        assert table.get(("C", 2000)) is None
+
+
+def test_runs_with_gaps():
+    # i % 3 != 0 gives many runs of two blocks under the same prefix
+    table, expected = fill([("C", i) for i in range(1, 3000) if i % 3 != 0])
+    check(table, expected)
+    assert ("C", 3) not in table
+    assert ("C", 0) not in table
+
+
+def test_transposed_keys():
+    n = 40
+    table, expected = fill([("C", j, i) for i in range(1, n + 1) for j in range(1, n + 1)])
+    check(table, expected)
+    assert ("C", 0, 1) not in table
+    assert ("C", 1, n + 1) not in table
+
+
+def test_mixed_keys_and_ids():
+    keys = [("Q",), ("A", 1), ("A", 2), ("A", 3), ("B", "x"), ("A", 5), ("A", 6),
+            ("A", 4), ("C", 1, 2), ("C", 1, 3), ("C", 2, 2), ("D",)]
+    table = BlockTable()
+    expected = {}
+    bId = 0
+    for step, key in enumerate(keys):
+        # ids of variables are interleaved with those of the blocks
+        bId += 1 if step % 4 else 3
+        table[key] = bId
+        expected[key] = bId
+    check(table, expected)
+    assert table.key_of(0) is None
+    assert table.key_of(bId + 1) is None